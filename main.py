@@ -19,112 +19,135 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import time
+
+# WEATHER_STARTUP_TIMING=1 prints how long the imports, the startup and the cache warm up took.
+startup_clock = time.perf_counter()
+
+import asyncio
+import os
 import shutil
+from contextlib import asynccontextmanager
 from datetime import datetime as dt
-from decimal import Decimal
 from os.path import exists
 from typing import Optional
 
-import uvicorn
-from fastapi import FastAPI, Query
-from starlette.responses import FileResponse
-from starlette.staticfiles import StaticFiles
+from fastapi import FastAPI, Query, Request
+from starlette.responses import FileResponse, JSONResponse, Response
 
-import scripts.db_ops
 from scripts.configs import check_config, solar_window_size, rain_window_size, barometer_window_size, GlobalConfig
 from scripts.db_ops import get_raw_wind_by_time, get_raw_rain_by_time, get_raw_temp_by_time, get_raw_barometer_by_time, \
-    get_raw_solar_by_time, check_db, db_conn
-from scripts.helper_functions import get_interval_where_str, process_wind_data, \
+    get_raw_solar_by_time, query_recent, run_query, fetch_all, fetch_one, commit_db, close_db, rollback_db, \
+    ensure_table, detect_compacted_history, connect_writer
+from scripts.anomaly import check_anomalies, quarantine_enabled, seed_anomaly_detector, describe_anomalies, \
+    get_quarantine_params, get_anomaly_params, get_anomaly_detector
+from scripts.derived_metrics import update_derived, seed_derived_state
+from scripts.helper_functions import get_interval, process_wind_data, \
     process_solar_data, process_rain_data, process_barometer, get_timediff_wind_window_size, process_rose_map, \
     make_times_limited, process_temperature_units
+from scripts.ingest import parse_observation, check_sanity, get_sanity_rules, log_ingest, start_ingest_logging, \
+    stop_ingest_logging
+from scripts.latest_observation import get_latest_bytes, set_latest_from_row, set_latest_from_observation, \
+    set_latest_derived
+from scripts.queries import create_derived_table_sql, create_anomaly_tables_sql
+from scripts.single_flight import query_flight
+from scripts.static_assets import PrecompressedStaticFiles, ApiGZipMiddleware, get_static_root
 
-db_conn.prepare_threshold = 0
+startup_timing = os.environ.get("WEATHER_STARTUP_TIMING") == "1"
 
-check_config()
 
-app = FastAPI()
+def log_startup_time(phase: str):
+    if startup_timing:
+        print("Startup: {} after {:.1f} ms".format(phase, (time.perf_counter() - startup_clock) * 1000))
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
 
-@app.get("/")
-async def root():
-    return FileResponse('index.html')
+log_startup_time("imports done")
 
+background_tasks = []
 
-@app.get("/detaildata.html")
-async def detail_response():
-    return FileResponse('detaildata.html')
 
+async def warm_start():
+    # runs once the server accepts requests, the database connection is opened here and not at import.
+    await asyncio.to_thread(seed_latest)
+    await asyncio.to_thread(load_history_source)
+    rows = await asyncio.to_thread(load_derived_seed)
+    if rows is not None:
+        set_latest_derived(seed_derived_state(rows))
+    rows = await asyncio.to_thread(load_anomaly_seed)
+    if rows is not None:
+        seed_anomaly_detector(rows)
+    log_startup_time("caches warmed up")
 
-@app.get("/favicon.ico")
-async def icon_ret():
-    return FileResponse('favicon.ico')
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    check_config()
+    get_sanity_rules()
+    log_startup_time("config loaded")
+    start_ingest_logging()
+    background_tasks.append(asyncio.create_task(warm_start()))
 
-async def get_wind(prior_days: Optional[int] = Query(None, alias="priorDays"),
-                   prior_hrs: Optional[int] = Query(None, alias="priorHrs")):
-    check_db()
-    where_str = get_interval_where_str(prior_days, prior_hrs)
+    retention_cfg = GlobalConfig.cfg.get("retention") or {}
+    if retention_cfg.get("enabled"):
+        from scripts.retention import retention_loop
+        background_tasks.append(asyncio.create_task(retention_loop()))
 
-    sql_query_str = \
-        "SELECT localdatetime as \"Time\", windspd AS \"Speed\", highwindspd AS \"Gust\", winddirection AS \"Direction\" FROM weather_data " + where_str + " ORDER BY localdatetime DESC"
-    result = scripts.db_ops.db_conn.cursor().execute(sql_query_str)
+    log_startup_time("startup done")
+    yield
 
-    return result.fetchall()
+    for task in background_tasks:
+        task.cancel()
+    stop_ingest_logging()
+    close_db()
 
 
-async def get_raw_baro(prior_days: Optional[int] = Query(None, alias="priorDays"),
-                       prior_hrs: Optional[int] = Query(None, alias="priorHrs")):
-    where_str = get_interval_where_str(prior_days, prior_hrs)
-    sql_query_str = "SELECT localdatetime AS \"Time\", barometer as \"Baro\", index_id FROM weather_data " + where_str + \
-                    " ORDER BY localdatetime DESC"
-    result = scripts.db_ops.db_conn.cursor().execute(sql_query_str)
-    data = result.fetchall()
+app = FastAPI(lifespan=lifespan)
 
-    return data
+app.add_middleware(ApiGZipMiddleware, minimum_size=1000)
 
+app.mount("/static", PrecompressedStaticFiles(directory=os.path.join(get_static_root(), "static")), name="static")
+# pages keep their name and are revalidated on every load (304 when unchanged), they point at the fingerprinted assets
+pages = PrecompressedStaticFiles(directory=get_static_root())
 
-@app.get("/api/solar")
-async def get_solar(prior_days: Optional[int] = Query(None, alias="priorDays"),
-                    prior_hrs: Optional[int] = Query(None, alias="priorHrs")):
-    check_db()
-    where_str = get_interval_where_str(prior_days, prior_hrs)
-    sql_query_str = "SELECT localdatetime AS \"Time\", solarrad as \"Solar\"," \
-                    " index_id FROM weather_data " + where_str + \
-                    " ORDER BY localdatetime DESC"
-    result = scripts.db_ops.db_conn.cursor().execute(sql_query_str)
-    data = result.fetchall()
+
+@app.get("/")
+async def root(request: Request):
+    return await pages.get_response('index.html', request.scope)
+
+
+@app.get("/detaildata.html")
+async def detail_response(request: Request):
+    return await pages.get_response('detaildata.html', request.scope)
+
+
+@app.get("/favicon.ico")
+async def icon_ret():
+    return FileResponse('favicon.ico')
+
+
+# The functions below do the query and the processing for one endpoint. They are coalesced: identical
+# requests arriving while one is being computed share its result (key: function + normalized arguments).
+@query_flight.coalesce
+async def compute_solar(interval):
+    data = await query_recent("solar", interval)
     return_data: list
     try:
         return_data = process_solar_data(data, solar_window_size)
     except:  # on any error
         return_data = []
-        scripts.db_ops.db_conn.close()
 
     return return_data
 
 
-@app.get("/api/rain")
-async def get_rain(prior_days: Optional[int] = Query(None, alias="priorDays"),
-                   prior_hrs: Optional[int] = Query(None, alias="priorHrs")):
-    check_db()
-    where_str = get_interval_where_str(prior_days, prior_hrs)
-    sql_query_str = "SELECT localdatetime AS \"Time\", rainrate as \"Rain\" FROM weather_data " + where_str + \
-                    " ORDER BY localdatetime DESC"
-    result = scripts.db_ops.db_conn.cursor().execute(sql_query_str)
-    data = result.fetchall()
-
+@query_flight.coalesce
+async def compute_rain(interval):
+    data = await query_recent("rain", interval)
     return process_rain_data(raw_data=data, sliding_window=rain_window_size)
 
 
-@app.get("/api/temperature")
-async def get_temp(prior_days: Optional[int] = Query(None, alias="priorDays"),
-                   prior_hrs: Optional[int] = Query(None, alias="priorHrs")):
-    where_str = get_interval_where_str(prior_days, prior_hrs)
-    sql_query_str = "SELECT localdatetime AS \"Time\", tempoutdoor as \"TempOut\", tempindoor AS \"TempIn\"  FROM weather_data {0} ORDER BY localdatetime DESC".format(
-        where_str)
-    result = scripts.db_ops.db_conn.cursor().execute(sql_query_str)
-    data = result.fetchall()
+@query_flight.coalesce
+async def compute_temperature(interval):
+    data = await query_recent("temperature", interval)
     return_data = []
 
     for item in data:
@@ -137,29 +160,104 @@ async def get_temp(prior_days: Optional[int] = Query(None, alias="priorDays"),
     return return_data
 
 
+@query_flight.coalesce
+async def compute_barometer(interval, altitude):
+    data = await query_recent("barometer", interval)
+    return process_barometer(data, barometer_window_size, altitude)
+
+
+@query_flight.coalesce
+async def compute_wind(interval, window_size):
+    raw_data = await query_recent("wind", interval)
+    return process_wind_data(raw_data, window_size)
+
+
+@query_flight.coalesce
+async def compute_rose_map(interval, speed_type):
+    raw_data = await query_recent("wind", interval)
+    return process_rose_map(raw_data, speed_type)
+
+
+@query_flight.coalesce
+async def compute_rose_map_by_time(start_timestamp, end_timestamp, speed_type):
+    raw_data = await get_raw_wind_by_time(start_timestamp, end_timestamp)
+    return process_rose_map(raw_data, speed_type)
+
+
+@query_flight.coalesce
+async def compute_wind_by_time(start_timestamp, end_timestamp):
+    raw_data = await get_raw_wind_by_time(start_timestamp, end_timestamp)
+    window_size = 5
+    return process_wind_data(raw_data, window_size)
+
+
+@query_flight.coalesce
+async def compute_rain_by_time(start_timestamp, end_timestamp):
+    raw_data = await get_raw_rain_by_time(start_timestamp, end_timestamp)
+    return process_rain_data(raw_data, sliding_window=rain_window_size)
+
+
+@query_flight.coalesce
+async def compute_temperature_by_time(start_timestamp, end_timestamp, unit):
+    raw_data = await get_raw_temp_by_time(start_timestamp, end_timestamp)
+    return await process_temperature_units(raw_data, unit)
+
+
+@query_flight.coalesce
+async def compute_solar_by_time(start_timestamp, end_timestamp):
+    raw_data = await get_raw_solar_by_time(start_timestamp, end_timestamp)
+    return process_solar_data(raw_data, sliding_window=solar_window_size)
+
+
+@query_flight.coalesce
+async def compute_barometer_by_time(start_timestamp, end_timestamp, altitude):
+    raw_data = await get_raw_barometer_by_time(start_timestamp, end_timestamp)
+    window_size = barometer_window_size
+    return process_barometer(raw_data, window_size, altitude)
+
+
+def normalize_altitude(altitude):
+    # None and 0 both mean no altitude correction
+    return altitude if altitude else 0
+
+
+@app.get("/api/solar")
+async def get_solar(prior_days: Optional[int] = Query(None, alias="priorDays"),
+                    prior_hrs: Optional[int] = Query(None, alias="priorHrs")):
+    return await compute_solar(get_interval(prior_days, prior_hrs))
+
+
+@app.get("/api/rain")
+async def get_rain(prior_days: Optional[int] = Query(None, alias="priorDays"),
+                   prior_hrs: Optional[int] = Query(None, alias="priorHrs")):
+    return await compute_rain(get_interval(prior_days, prior_hrs))
+
+
+@app.get("/api/temperature")
+async def get_temp(prior_days: Optional[int] = Query(None, alias="priorDays"),
+                   prior_hrs: Optional[int] = Query(None, alias="priorHrs")):
+    return await compute_temperature(get_interval(prior_days, prior_hrs))
+
+
 @app.get("/api/barometer")
 async def get_baro(prior_days: Optional[int] = Query(None, alias="priorDays"),
                    prior_hrs: Optional[int] = Query(None, alias="priorHrs"),
                    altitude: Optional[int] = Query(None, alias="altitude")):
-    data = await get_raw_baro(prior_days, prior_hrs)
-
-    return process_barometer(data, barometer_window_size, altitude)
+    return await compute_barometer(get_interval(prior_days, prior_hrs), normalize_altitude(altitude))
 
 
 @app.get("/api/windByTime")
 async def get_wind_by_time_difference(prior_days: Optional[int] = Query(None, alias="priorDays"),
                                       prior_hrs: Optional[int] = Query(None, alias="priorHrs")):
-    raw_data = await get_wind(prior_days, prior_hrs)
     window_size = await get_timediff_wind_window_size(prior_days, prior_hrs)
-    return process_wind_data(raw_data, window_size)
+    return await compute_wind(get_interval(prior_days, prior_hrs), window_size)
 
 
 @app.get("/api/wind/rosemap")
 async def get_rosemap_item(speed_type: Optional[int] = Query(0, alias="SpeedType"),
                            prior_days: Optional[int] = Query(None, alias="priorDays"),
                            prior_hrs: Optional[int] = Query(None, alias="priorHrs")):
-    raw_data = await get_wind(prior_days, prior_hrs)
-    return process_rose_map(raw_data, speed_type)
+    return await compute_rose_map(get_interval(prior_days, prior_hrs), speed_type)
 
 
 @app.get("/api/ByTime/wind/rosemap")
@@ -170,8 +268,7 @@ async def get_rosemap_by_time(speed_type: Optional[int] = Query(0, alias="SpeedT
         return {"error": "startTime is None or endTime is None", "code": 500}
 
     start_timestamp, end_timestamp = make_times_limited(start_timestamp, end_timestamp)
-    raw_data = await get_raw_wind_by_time(start_timestamp, end_timestamp)
-    return process_rose_map(raw_data, speed_type)
+    return await compute_rose_map_by_time(start_timestamp, end_timestamp, speed_type)
 
 
 @app.get("/api/ByTime/wind")
@@ -181,10 +278,7 @@ async def get_wind_by_time(start_timestamp: str = Query(None, alias="startTime")
         return {"error": "startTime is None or endTime is None", "code": 500}
 
     start_timestamp, end_timestamp = make_times_limited(start_timestamp, end_timestamp)
-
-    raw_data = await get_raw_wind_by_time(start_timestamp, end_timestamp)
-    window_size = 5
-    return process_wind_data(raw_data, window_size)
+    return await compute_wind_by_time(start_timestamp, end_timestamp)
 
 
 @app.get("/api/ByTime/rain")
@@ -193,8 +287,7 @@ async def get_rain_by_time(start_timestamp: str = Query(None, alias="startTime")
     if start_timestamp is None or end_timestamp is None:
         return {"error": "startTime is None or endTime is None", "code": 500}
     start_timestamp, end_timestamp = make_times_limited(start_timestamp, end_timestamp)
-    raw_data = await get_raw_rain_by_time(start_timestamp, end_timestamp)
-    return process_rain_data(raw_data, sliding_window=rain_window_size)
+    return await compute_rain_by_time(start_timestamp, end_timestamp)
 
 
 @app.get("/api/ByTime/temperature")
@@ -205,10 +298,7 @@ async def get_temp_by_time(start_timestamp: str = Query(None, alias="startTime")
         return {"error": "startTime is None or endTime is None", "code": 500}
 
     start_timestamp, end_timestamp = make_times_limited(start_timestamp, end_timestamp)
-    raw_data = await get_raw_temp_by_time(start_timestamp, end_timestamp)
-    return_data = await process_temperature_units(raw_data, unit)
-
-    return return_data
+    return await compute_temperature_by_time(start_timestamp, end_timestamp, unit)
 
 
 @app.get("/api/ByTime/solar")
@@ -217,8 +307,7 @@ async def get_solar_by_time(start_timestamp: str = Query(None, alias="startTime"
     if start_timestamp is None or end_timestamp is None:
         return {"error": "startTime is None or endTime is None", "code": 500}
     start_timestamp, end_timestamp = make_times_limited(start_timestamp, end_timestamp)
-    raw_data = await get_raw_solar_by_time(start_timestamp, end_timestamp)
-    return process_solar_data(raw_data, sliding_window=solar_window_size)
+    return await compute_solar_by_time(start_timestamp, end_timestamp)
 
 
 @app.get("/api/ByTime/barometer")
@@ -229,133 +318,150 @@ async def get_barometer_by_time(start_timestamp: str = Query(None, alias="startT
         return {"error": "startTime is None or endTime is None", "code": 500}
 
     start_timestamp, end_timestamp = make_times_limited(start_timestamp, end_timestamp)
-    raw_data = await get_raw_barometer_by_time(start_timestamp, end_timestamp)
-    window_size = barometer_window_size
-    return process_barometer(raw_data, window_size, altitude)
+    return await compute_barometer_by_time(start_timestamp, end_timestamp, normalize_altitude(altitude))
+
+
+@app.get("/api/metrics/coalescing")
+async def get_coalescing_metrics():
+    return query_flight.get_metrics()
 
 
 @app.get("/v01/set")
-async def set_api(wid: str, key: str, tempin: int, humin: int,
-                  temp: int, hum: int, dewin: int, dew: int,
-                  chill: int, heatin: int, heat: int, thw: int,
-                  bar: int, wspd: int, wspdhi: int, wdir: int, wspdavg: int,
-                  wdiravg: int, rainrate: int, rain: int, solarrad: int,
-                  uvi: int, battery: str, datestr: str = Query(None, alias="date"),
-                  timestr: str = Query(None, alias="time")):
-    check_db()
-    local_tm = dt.now()
-    utc_tm = dt.utcnow()
-    offset = local_tm - utc_tm
-    long_datetime_val = dt.now()
-    temp_indoor = tempin / 10
-    heat_index_val = heatin / 10
-    temp_outdoor = temp / 10
-    heat_val = heat / 10
-    wind_speed = wspd / 10
-    wind_speed_high = wspdhi / 10
-    wind_speed_average = wspdavg / 10
-    barometer_hpa = bar / 10
-    rain_daily_depth = rain / 10
-    solar_radiation = solarrad / 10
-    chill_index = chill / 10
-    temp_humid_wind_index = thw / 10
-    rain_rate = rainrate / 10
-    dew_point_outdoor = dew / 10
-    dew_point_indoor = dewin / 10
-    if temp_indoor < -100 or solar_radiation < -100 or temp_outdoor < -100 or heat_index_val < -100 or thw < -1000 or \
-            dew_point_outdoor < -100 or dew_point_indoor < -100:
+async def set_api(request: Request):
+    try:
+        observation = parse_observation(request.query_params, dt.now())
+    except ValueError as ex:
+        log_ingest("rejected", reason=str(ex))
+        return JSONResponse({"error": str(ex), "code": 422}, status_code=422)
+
+    broken_rule = check_sanity(observation)
+    if broken_rule is not None:
+        log_ingest("dropped", time=observation["dateobj"], rule=broken_rule)
         return 200
 
     try:
-        result = db_conn.cursor().execute("""
-            INSERT INTO "weather_data" 
-            ("localdatetime", "tempindoor", "humindoor", "tempoutdoor", "humoutdoor", "dewindoor", 
-            "dewoutdoor", "WindChill", "heatindex", "temphumidwindindex", "barometer", "windspd", 
-            "highwindspd", "winddirection", "avgwindspd", "avgwinddir", "rainrate", "raindaily", 
-            "solarrad", "uvindex", "batterystate", "heat" )
-             VALUES 
-             (%(dateobj)s, %(temp_in)s, %(hum_in)s, %(temp_out)s, %(hum_out)s, %(dew_in)s, 
-             %(dew_out)s, %(chill_idx)s, %(heatindex)s, %(thw_idx)s, %(baro)s, %(wind_spd)s, 
-             %(high_wind)s, %(wind_dir)s, %(avg_wind_spd)s, %(avg_wind_dir)s, %(rainrate)s, %(raindaily)s , 
-             %(solar_rad)s, %(uvi)s, %(batt)s, %(heat)s);
-        """, {
-            "dateobj": long_datetime_val,
-            "temp_in": temp_indoor,
-            "hum_in": humin,
-            "temp_out": temp_outdoor,
-            "hum_out": hum,
-            "dew_in": dew_point_indoor,
-            "dew_out": dew_point_outdoor,
-            "chill_idx": chill_index,
-            "heatindex": heat_index_val,
-            "thw_idx": temp_humid_wind_index,
-            "baro": barometer_hpa,
-            "wind_spd": wind_speed,
-            "high_wind": wind_speed_high,
-            "wind_dir": wdir,
-            "avg_wind_spd": wind_speed_average,
-            "avg_wind_dir": wdiravg,
-            "rainrate": rain_rate,
-            "raindaily": rain_daily_depth,
-            "solar_rad": solar_radiation,
-            "uvi": uvi,
-            "batt": battery,
-            "heat": heat_val
-        })
-        print(result)
-        db_conn.commit()
+        await connect_writer()
     except Exception as ex:
-        print(str(ex))
-        db_conn.close()
+        log_ingest("failed", time=observation["dateobj"], error=str(ex))
         return 500
 
+    anomalies = check_anomalies(observation)
+    if anomalies and quarantine_enabled():
+        store_quarantined(observation, anomalies)
+        return 200
+
+    try:
+        index_id = run_query("insert_observation", observation).fetchone()["index_id"]
+        commit_db()
+    except Exception as ex:
+        log_ingest("failed", time=observation["dateobj"], error=str(ex))
+        rollback_db()
+        return 500
+
+    log_ingest("stored", time=observation["dateobj"], index_id=index_id)
+    derived = update_derived(observation, {metric for metric, _, _ in anomalies})
+    store_derived(index_id, observation["dateobj"], derived)
+    if anomalies:
+        store_anomalies(index_id, observation, anomalies)
+    set_latest_from_observation(observation)
+    set_latest_derived(derived)
     return 200
 
 
+def store_derived(index_id, observation_time, derived: dict):
+    # the raw row is committed already, losing the sidecar row must not lose the observation
+    try:
+        params = dict(derived)
+        params["index_id"] = index_id
+        params["dateobj"] = observation_time
+        run_query("insert_derived", params)
+        commit_db()
+    except Exception as ex:
+        log_ingest("derived_failed", index_id=index_id, error=str(ex))
+        rollback_db()
+
+
+def store_anomalies(index_id, observation: dict, anomalies: list):
+    log_ingest("flagged", index_id=index_id, anomalies=describe_anomalies(anomalies))
+    try:
+        for params in get_anomaly_params(index_id, observation, anomalies):
+            run_query("insert_anomaly", params)
+        commit_db()
+    except Exception as ex:
+        log_ingest("flag_failed", index_id=index_id, error=str(ex))
+        rollback_db()
+
+
+def store_quarantined(observation: dict, anomalies: list):
+    log_ingest("quarantined", time=observation["dateobj"], anomalies=describe_anomalies(anomalies))
+    try:
+        run_query("insert_quarantine", get_quarantine_params(observation, anomalies))
+        commit_db()
+    except Exception as ex:
+        log_ingest("quarantine_failed", time=observation["dateobj"], error=str(ex))
+        rollback_db()
+
+
+def load_history_source():
+    try:
+        detect_compacted_history()
+    except Exception as ex:
+        print("Could not check for the compacted history: " + str(ex))
+
+
+def load_anomaly_seed():
+    if get_anomaly_detector() is None:
+        return None
+    try:
+        ensure_table(create_anomaly_tables_sql, "weather_anomaly", "weather_data_quarantine")
+        return fetch_all("anomaly_seed")
+    except Exception as ex:
+        print("Could not load the observations for the anomaly detection: " + str(ex))
+        return None
+
+
+def load_derived_seed():
+    try:
+        ensure_table(create_derived_table_sql, "weather_derived", "idx_derived_ldt")
+        # the seed query reads the flags, the table exists even with the anomaly detection turned off
+        ensure_table(create_anomaly_tables_sql, "weather_anomaly", "weather_data_quarantine")
+        return fetch_all("derived_seed")
+    except Exception as ex:
+        print("Could not load the observations for the derived metrics: " + str(ex))
+        return None
+
+
+@app.get("/api/derived")
+async def get_derived(prior_days: Optional[int] = Query(None, alias="priorDays"),
+                      prior_hrs: Optional[int] = Query(None, alias="priorHrs")):
+    return await query_recent("derived", get_interval(prior_days, prior_hrs))
+
+
+@app.get("/api/latest")
+async def latest_info(altitude: Optional[int] = Query(None, alias="altitude")):
+    body = get_latest_bytes(altitude)
+    if body is None:
+        # nothing uploaded since the start and the seeding at startup failed, try the database again
+        await asyncio.to_thread(seed_latest)
+        body = get_latest_bytes(altitude)
+    if body is None:
+        return None
+
+    return Response(content=body, media_type="application/json")
+
+
+def seed_latest():
+    try:
+        set_latest_from_row(fetch_one("latest"))
+    except Exception as ex:
+        print("Could not load the latest observation: " + str(ex))
+
+
 if __name__ == "__main__":
     if not GlobalConfig.init_ok:
         exit(0)
 
+    import uvicorn
+
     uvicorn.run("main:app", host=GlobalConfig.cfg["server"]["host"],
                 port=GlobalConfig.cfg["server"]["port"], log_level=GlobalConfig.cfg["server"]["log_level"])
-
-
-@app.get("/api/latest")
-async def latest_info(altitude: Optional[int] = Query(None, alias="altitude")):
-    check_db()
-    baro_abs_stmt = "weather_data.barometer as \"barometer_abs\""
-
-    if altitude is not None and altitude != 0:
-        fix_num = Decimal(altitude) / Decimal(100) * Decimal(12)
-        baro_abs_stmt = " round(weather_data.barometer - {},1)as \"barometer_abs\"".format(fix_num)
-
-    sql_stmt = """SELECT
-        to_char(weather_data.localdatetime, 'YYYY-MM-DD HH24:MI:SS') AS "Time", 
-        weather_data.tempindoor, 
-        weather_data.humindoor, 
-        weather_data.tempoutdoor, 
-        weather_data.humoutdoor, 
-        weather_data.dewindoor, 
-        weather_data.dewoutdoor, 
-        weather_data."WindChill", 
-        weather_data.heatindex, 
-        weather_data.temphumidwindindex, 
-        weather_data.barometer, 
-        {},
-        ROUND(weather_data.windspd*1.9438444924, 2) as "windspd", 
-        ROUND(weather_data.highwindspd*1.9438444924, 2) as "highwindspd", 
-        weather_data.winddirection, 
-        ROUND(weather_data.avgwindspd,2) as "avgwindspd", 
-        weather_data.avgwinddir, 
-        weather_data.rainrate, 
-        weather_data.raindaily, 
-        weather_data.solarrad, 
-        weather_data.uvindex / 10 as "uvindex", 
-        weather_data.heat
-    FROM
-        weather_data
-    ORDER BY
-        weather_data.localdatetime DESC
-    LIMIT 1""".format(baro_abs_stmt)
-
-    return db_conn.cursor().execute(sql_stmt).fetchone()
@@ -0,0 +1,310 @@
+# Spike / glitch detection for the uploaded observations.
+# At ingest every configured metric goes through a StreamingDetector (hard limits, maximum jump from the
+# previous sample and an exponentially weighted z-score, O(1) state per metric). Flagged samples are either
+# stored and recorded in weather_anomaly (mode: flag) or kept out of weather_data in
+# weather_data_quarantine (mode: quarantine).
+#
+# Re-scoring the history in bulk runs set based in the database with window functions:
+#   python -m scripts.anomaly --replay [--days N]
+import argparse
+import json
+import math
+from datetime import datetime as dt, timedelta
+
+import psycopg
+from psycopg import sql
+from psycopg.rows import dict_row
+
+from scripts.configs import GlobalConfig
+
+# metric (key in the "insert_observation" parameters) -> weather_data column
+metric_columns = {
+    "temp_in": "tempindoor",
+    "hum_in": "humindoor",
+    "temp_out": "tempoutdoor",
+    "hum_out": "humoutdoor",
+    "dew_in": "dewindoor",
+    "dew_out": "dewoutdoor",
+    "baro": "barometer",
+    "wind_spd": "windspd",
+    "high_wind": "highwindspd",
+    "avg_wind_spd": "avgwindspd",
+    "rainrate": "rainrate",
+    "solar_rad": "solarrad",
+    "uvi": "uvindex"
+}
+
+rule_defaults = {
+    "min": None,
+    "max": None,
+    "max_step": None,
+    "z_threshold": None,
+    "alpha": 0.05,
+    "min_samples": 30,
+    "min_std": 0.5,
+    # after this many flagged samples in a row the new level is accepted (a real change, not a glitch)
+    "max_consecutive": 5,
+    # samples before the current one the replay computes mean / standard deviation over
+    "replay_window": 60
+}
+
+
+class StreamingDetector:
+    def __init__(self, rule: dict):
+        cfg = dict(rule_defaults)
+        cfg.update(rule or {})
+        self.min = cfg["min"]
+        self.max = cfg["max"]
+        self.max_step = cfg["max_step"]
+        self.z_threshold = cfg["z_threshold"]
+        self.alpha = float(cfg["alpha"])
+        self.min_samples = int(cfg["min_samples"])
+        self.min_std = float(cfg["min_std"])
+        self.max_consecutive = int(cfg["max_consecutive"])
+        self.reset()
+
+    def reset(self):
+        self.mean = 0.0
+        self.var = 0.0
+        self.count = 0
+        self.last = None
+        self.consecutive = 0
+
+    def accept(self, value: float):
+        # exponentially weighted mean and variance
+        if self.count == 0:
+            self.mean = value
+            self.var = 0.0
+        else:
+            diff = value - self.mean
+            increment = self.alpha * diff
+            self.mean += increment
+            self.var = (1 - self.alpha) * (self.var + diff * increment)
+        self.last = value
+        self.count += 1
+
+    def check(self, value: float):
+        """
+        Returns the reason the value looks wrong, None if it is plausible. Plausible values update the state.
+        """
+        if self.min is not None and value < self.min:
+            return "below {}".format(self.min)
+        if self.max is not None and value > self.max:
+            return "above {}".format(self.max)
+
+        reason = None
+        if self.max_step is not None and self.last is not None and abs(value - self.last) > self.max_step:
+            reason = "jump of {:.2f} from {}".format(value - self.last, self.last)
+        elif self.z_threshold is not None and self.count >= self.min_samples:
+            z_score = abs(value - self.mean) / max(math.sqrt(self.var), self.min_std)
+            if z_score > self.z_threshold:
+                reason = "z-score {:.1f}".format(z_score)
+
+        if reason is not None:
+            self.consecutive += 1
+            if self.consecutive <= self.max_consecutive:
+                return reason
+            # the "spike" persists, start over from the new level
+            self.reset()
+
+        self.consecutive = 0
+        self.accept(value)
+        return None
+
+
+class AnomalyDetector:
+    def __init__(self, metric_rules: dict):
+        self.detectors = {metric: StreamingDetector(rule) for metric, rule in metric_rules.items()
+                          if metric in metric_columns}
+
+    def check(self, observation: dict) -> list:
+        # list of (metric, value, reason) for the flagged metrics of the observation
+        anomalies = []
+        for metric, detector in self.detectors.items():
+            value = observation.get(metric)
+            if value is None:
+                continue
+            reason = detector.check(float(value))
+            if reason is not None:
+                anomalies.append((metric, value, reason))
+        return anomalies
+
+    def seed(self, rows):
+        # rows as returned by the "anomaly_seed" query, oldest first. Skipped if uploads arrived meanwhile.
+        if any(detector.count > 0 for detector in self.detectors.values()):
+            return
+        for row in rows:
+            for metric, detector in self.detectors.items():
+                value = row.get(metric_columns[metric])
+                if value is not None:
+                    detector.check(float(value))
+
+
+def get_anomaly_config():
+    cfg = {"enabled": False, "mode": "flag", "metrics": {}}
+    cfg.update(GlobalConfig.cfg.get("anomaly") or {})
+    return cfg
+
+
+anomaly_detector = None
+
+
+def get_anomaly_detector():
+    # None if the detection is disabled
+    global anomaly_detector
+    cfg = get_anomaly_config()
+    if not cfg["enabled"]:
+        return None
+    if anomaly_detector is None:
+        anomaly_detector = AnomalyDetector(cfg["metrics"] or {})
+    return anomaly_detector
+
+
+def check_anomalies(observation: dict) -> list:
+    detector = get_anomaly_detector()
+    if detector is None:
+        return []
+    return detector.check(observation)
+
+
+def quarantine_enabled():
+    cfg = get_anomaly_config()
+    return cfg["enabled"] and cfg["mode"] == "quarantine"
+
+
+def seed_anomaly_detector(rows):
+    detector = get_anomaly_detector()
+    if detector is not None:
+        detector.seed(rows)
+
+
+def describe_anomalies(anomalies: list):
+    return "; ".join("{}={} {}".format(metric, value, reason) for metric, value, reason in anomalies)
+
+
+def get_quarantine_params(observation: dict, anomalies: list):
+    return {
+        "dateobj": observation["dateobj"],
+        "observation": json.dumps(observation, default=str),
+        "reasons": describe_anomalies(anomalies)
+    }
+
+
+def get_anomaly_params(index_id, observation: dict, anomalies: list):
+    return [{
+        "index_id": index_id,
+        "dateobj": observation["dateobj"],
+        "metric": metric,
+        "value": value,
+        "reason": reason
+    } for metric, value, reason in anomalies]
+
+
+replay_sql = sql.SQL("""
+    WITH samples AS (
+        SELECT index_id, localdatetime, {column}::float8 AS value,
+               coalesce({column} < %(min)s OR {column} > %(max)s, false) AS out_of_range
+        FROM weather_data
+        WHERE localdatetime >= %(start)s
+    ),
+    -- neighbours among the samples within the limits. A glitch jumps away from both of them,
+    -- the sample after it (back to the real level) or a real change only from one.
+    neighbours AS (
+        SELECT index_id, localdatetime, value,
+               lag(value) OVER by_time AS last_value,
+               coalesce(abs(value - lag(value) OVER by_time) > %(max_step)s
+                        AND abs(value - lead(value) OVER by_time) > %(max_step)s, false) AS spike
+        FROM samples
+        WHERE NOT out_of_range
+        WINDOW by_time AS (ORDER BY localdatetime)
+    ),
+    -- the statistics only see the plausible samples, like the streaming detector's running mean
+    scored AS (
+        SELECT index_id, localdatetime, value,
+               avg(value) OVER previous AS mean,
+               stddev_samp(value) OVER previous AS std,
+               count(*) OVER previous AS samples
+        FROM neighbours
+        WHERE NOT spike
+        WINDOW previous AS (ORDER BY localdatetime ROWS BETWEEN {window} PRECEDING AND 1 PRECEDING)
+    ),
+    flagged AS (
+        SELECT index_id, localdatetime, value,
+               CASE WHEN value < %(min)s THEN 'replay: below ' || %(min)s ELSE 'replay: above ' || %(max)s END AS reason
+        FROM samples
+        WHERE out_of_range
+        UNION ALL
+        SELECT index_id, localdatetime, value, 'replay: jump from ' || last_value
+        FROM neighbours
+        WHERE spike
+        UNION ALL
+        SELECT index_id, localdatetime, value,
+               'replay: z-score ' || round((abs(value - mean) / greatest(std, %(min_std)s))::numeric, 1)
+        FROM scored
+        WHERE samples >= %(min_samples)s AND abs(value - mean) / greatest(std, %(min_std)s) > %(z_threshold)s
+    )
+    INSERT INTO weather_anomaly (index_id, localdatetime, metric, value, reason)
+    SELECT index_id, localdatetime, %(metric)s, value, reason
+    FROM flagged
+    ON CONFLICT (index_id, metric) DO UPDATE SET value = excluded.value, reason = excluded.reason
+        WHERE weather_anomaly.reason LIKE 'replay: %%'
+""")
+
+# Every reason the replay writes starts with "replay: ". Its earlier flags in the range are recomputed,
+# the ones from the ingest are neither overwritten (see the ON CONFLICT above) nor deleted.
+clear_replay_sql = """
+    DELETE FROM weather_anomaly
+    WHERE metric = %(metric)s AND localdatetime >= %(start)s AND reason LIKE 'replay: %%'
+"""
+
+
+def replay(days: int):
+    """
+    Re-scores the stored observations of the last days against the configured rules, one set based statement
+    per metric. The streaming detector's weighted statistics are replaced by the mean / standard deviation of
+    the replay_window previous plausible samples, and a jump is only flagged when the sample stands out from
+    both its neighbours (a spike). Flagged rows are written to weather_anomaly, samples already flagged at
+    ingest keep their flag. Returns the number of flagged samples per metric.
+    """
+    cfg = get_anomaly_config()
+    start = dt.now() - timedelta(days=days)
+    flagged_counts = {}
+
+    with psycopg.connect(GlobalConfig.cfg["database"]["connection_str"], row_factory=dict_row,
+                         autocommit=True) as conn:
+        for metric, rule in (cfg["metrics"] or {}).items():
+            if metric not in metric_columns:
+                print("Unknown metric {}, skipped".format(metric))
+                continue
+            rule_cfg = dict(rule_defaults)
+            rule_cfg.update(rule or {})
+            statement = replay_sql.format(column=sql.Identifier(metric_columns[metric]),
+                                          window=sql.Literal(int(rule_cfg["replay_window"])))
+            params = {
+                "start": start,
+                "metric": metric,
+                "min": rule_cfg["min"],
+                "max": rule_cfg["max"],
+                "max_step": rule_cfg["max_step"],
+                "min_std": rule_cfg["min_std"],
+                "min_samples": rule_cfg["min_samples"],
+                "z_threshold": rule_cfg["z_threshold"]
+            }
+            with conn.transaction():
+                conn.execute(clear_replay_sql, params)
+                # NULL limits never match, so unset rules are skipped by the statement itself
+                flagged = conn.execute(statement, params).rowcount
+            flagged_counts[metric] = flagged
+            print("{}: {} samples flagged".format(metric, flagged))
+    return flagged_counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Anomaly detection for the stored observations")
+    parser.add_argument("--replay", action="store_true", help="re-score the stored observations")
+    parser.add_argument("--days", type=int, default=30, help="how many days back to re-score")
+    args = parser.parse_args()
+    if args.replay:
+        replay(args.days)
+    else:
+        parser.print_help()
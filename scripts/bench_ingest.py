@@ -0,0 +1,97 @@
+# Measures the /v01/set request overhead (without the database insert) of the old FastAPI handler with
+# 24 validated query parameters against the table driven parser in scripts/ingest.py.
+# Runs on a single core, run from the repository root:  python -m scripts.bench_ingest [requests]
+import asyncio
+import os
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import datetime as dt
+
+from fastapi import FastAPI, Query, Request
+
+from scripts.ingest import parse_observation, check_sanity, log_ingest, start_ingest_logging, stop_ingest_logging
+
+query_string = b"wid=0123456789&key=abcdef&tempin=215&humin=40&temp=-35&hum=80&dewin=51&dew=-60&chill=-40" \
+               b"&heatin=-35&heat=-35&thw=-41&bar=10132&wspd=34&wspdhi=56&wdir=270&wspdavg=30&wdiravg=265" \
+               b"&rainrate=0&rain=12&solarrad=0&uvi=5&battery=ok&date=20261019&time=1200"
+
+legacy_app = FastAPI()
+lean_app = FastAPI()
+
+
+@legacy_app.get("/v01/set")
+async def legacy_set_api(wid: str, key: str, tempin: int, humin: int,
+                         temp: int, hum: int, dewin: int, dew: int,
+                         chill: int, heatin: int, heat: int, thw: int,
+                         bar: int, wspd: int, wspdhi: int, wdir: int, wspdavg: int,
+                         wdiravg: int, rainrate: int, rain: int, solarrad: int,
+                         uvi: int, battery: str, datestr: str = Query(None, alias="date"),
+                         timestr: str = Query(None, alias="time")):
+    local_tm = dt.now()
+    utc_tm = dt.utcnow()
+    offset = local_tm - utc_tm
+    observation = {
+        "dateobj": dt.now(), "temp_in": tempin / 10, "hum_in": humin, "temp_out": temp / 10, "hum_out": hum,
+        "dew_in": dewin / 10, "dew_out": dew / 10, "chill_idx": chill / 10, "heatindex": heatin / 10,
+        "thw_idx": thw / 10, "baro": bar / 10, "wind_spd": wspd / 10, "high_wind": wspdhi / 10, "wind_dir": wdir,
+        "avg_wind_spd": wspdavg / 10, "avg_wind_dir": wdiravg, "rainrate": rainrate / 10, "raindaily": rain / 10,
+        "solar_rad": solarrad / 10, "uvi": uvi, "batt": battery, "heat": heat / 10
+    }
+    if observation["temp_in"] < -100 or observation["solar_rad"] < -100 or observation["temp_out"] < -100 or \
+            observation["heatindex"] < -100 or thw < -1000 or observation["dew_out"] < -100 or \
+            observation["dew_in"] < -100:
+        return 200
+    print(observation)
+    return 200
+
+
+@lean_app.get("/v01/set")
+async def lean_set_api(request: Request):
+    observation = parse_observation(request.query_params, dt.now())
+    broken_rule = check_sanity(observation)
+    if broken_rule is not None:
+        return 200
+    log_ingest("stored", time=observation["dateobj"])
+    return 200
+
+
+async def run_requests(app, count: int):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/v01/set", "raw_path": b"/v01/set", "root_path": "", "query_string": query_string,
+        "headers": [(b"host", b"localhost")], "client": ("127.0.0.1", 50000), "server": ("localhost", 80)
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start" and message["status"] != 200:
+            raise RuntimeError("unexpected status {}".format(message["status"]))
+
+    started = time.perf_counter()
+    for i in range(count):
+        await app(dict(scope), receive, send)
+    return count / (time.perf_counter() - started)
+
+
+async def main(count: int):
+    # route lookup and dependency setup happen on the first calls, don't count them.
+    # Both handlers log every stored sample, to /dev/null so the terminal speed doesn't matter.
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        await run_requests(legacy_app, 100)
+        legacy_rate = await run_requests(legacy_app, count)
+
+        start_ingest_logging()
+        await run_requests(lean_app, 100)
+        lean_rate = await run_requests(lean_app, count)
+        stop_ingest_logging()
+
+    print("legacy /v01/set: {:10.0f} requests/s".format(legacy_rate))
+    print("lean   /v01/set: {:10.0f} requests/s".format(lean_rate))
+    print("speedup:         {:10.2f}x".format(lean_rate / legacy_rate))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
@@ -0,0 +1,97 @@
+# Builds the static assets into build/: every file under static/ gets a fingerprinted copy
+# (name.<content hash>.ext), the pages and stylesheets are rewritten to point at the fingerprinted names,
+# and the text assets are precompressed to .gz (and .br if the brotli package is installed).
+# The server uses build/ automatically once it exists, see scripts/static_assets.py.
+# Run from the repository root:  python -m scripts.build_static
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+build_dir = "build"
+pages = ["index.html", "detaildata.html"]
+compressible_extensions = {".html", ".css", ".js", ".map", ".svg", ".ttf", ".eot", ".json"}
+# references like "/static/js/vue.js", 'static/css/x.css' or url('/static/fonts/a.ttf#b')
+static_ref_pattern = re.compile(r"""(?P<quote>["'(])/?static/(?P<path>[^"')?#]+)""")
+
+
+def fingerprinted_name(rel_path: str, content: bytes):
+    base, ext = os.path.splitext(rel_path)
+    return "{}.{}{}".format(base, hashlib.sha256(content).hexdigest()[:10], ext)
+
+
+def rewrite_static_refs(text: str, manifest: dict):
+    def replace(match):
+        path = match.group("path")
+        if path not in manifest:
+            return match.group(0)
+        return match.group("quote") + "/static/" + manifest[path]
+
+    return static_ref_pattern.sub(replace, text)
+
+
+def write_file(path: str, content: bytes):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as out_file:
+        out_file.write(content)
+
+    if os.path.splitext(path)[1] not in compressible_extensions:
+        return
+    write_compressed(path + ".gz", gzip.compress(content, compresslevel=9, mtime=0), len(content))
+    if brotli is not None:
+        write_compressed(path + ".br", brotli.compress(content, quality=11), len(content))
+
+
+def write_compressed(path: str, compressed: bytes, original_size: int):
+    # not worth the Content-Encoding if it doesn't get smaller
+    if len(compressed) < original_size:
+        with open(path, "wb") as out_file:
+            out_file.write(compressed)
+
+
+def build():
+    if os.path.exists(build_dir):
+        shutil.rmtree(build_dir)
+
+    static_files = []
+    for dir_path, dir_names, file_names in os.walk("static"):
+        for file_name in file_names:
+            static_files.append(os.path.relpath(os.path.join(dir_path, file_name), "static").replace(os.sep, "/"))
+
+    # stylesheets refer to the fonts, so everything else has to be fingerprinted before them
+    static_files.sort(key=lambda rel_path: (rel_path.endswith(".css"), rel_path))
+
+    manifest = {}
+    for rel_path in static_files:
+        with open(os.path.join("static", rel_path), "rb") as in_file:
+            content = in_file.read()
+        if rel_path.endswith(".css"):
+            content = rewrite_static_refs(content.decode("utf-8"), manifest).encode("utf-8")
+
+        manifest[rel_path] = fingerprinted_name(rel_path, content)
+        # the original name stays available for anything that isn't rewritten, like the source maps
+        write_file(os.path.join(build_dir, "static", rel_path), content)
+        write_file(os.path.join(build_dir, "static", manifest[rel_path]), content)
+
+    for page in pages:
+        with open(page, "r", encoding="utf-8") as in_file:
+            text = rewrite_static_refs(in_file.read(), manifest)
+        write_file(os.path.join(build_dir, page), text.encode("utf-8"))
+
+    with open(os.path.join(build_dir, "manifest.json"), "w", encoding="utf-8") as out_file:
+        json.dump(manifest, out_file, indent=2, sort_keys=True)
+
+    print("Built {} static files and {} pages into {}/".format(len(manifest), len(pages), build_dir))
+    if brotli is None:
+        print("brotli is not installed, only .gz variants were written (pip install brotli)")
+
+
+if __name__ == "__main__":
+    build()
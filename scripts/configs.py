@@ -2,36 +2,45 @@ import shutil
 from os.path import exists
 
 import yaml
-import yaml.loader as ldr
 
 
 class Config:
+    # config.yaml is read on first use and only once, importing this module doesn't touch the disk.
     def __init__(self):
+        self.loaded_cfg = None
+        self.loaded_ok = None
+
+    def load(self):
         if exists("config.yaml"):
-            with open("config.yaml", 'r', encoding='utf-8') as self.in_file:
-                self.yaml_content = self.in_file.read()
-                self.cfg = yaml.safe_load(self.yaml_content)  # Use safe_load for a single document
-                self.init_ok = True
+            with open("config.yaml", 'r', encoding='utf-8') as in_file:
+                self.loaded_cfg = yaml.safe_load(in_file.read())  # Use safe_load for a single document
+                self.loaded_ok = True
         else:
             shutil.copy("default.yaml", "config.yaml")
             print("Please edit config.yaml to represent your current configuration!")
             print("App will now quit.")
-            self.init_ok = False
+            self.loaded_cfg = {}
+            self.loaded_ok = False
+
+    @property
+    def cfg(self) -> dict:
+        if self.loaded_ok is None:
+            self.load()
+        return self.loaded_cfg
+
+    @property
+    def init_ok(self) -> bool:
+        if self.loaded_ok is None:
+            self.load()
+        return self.loaded_ok
 
 
 GlobalConfig: Config = Config()
 
 
 def check_config():
-    if not exists("config.yaml"):
-        shutil.copy("default.yaml", "config.yaml")
-        print("Please edit config.yaml to represent your current configuration!")
-        print("App will now quit.")
+    if not GlobalConfig.init_ok:
         exit(0)
-    else:
-        with open("config.yaml", 'r', encoding='utf-8') as in_file:
-            yaml_content = in_file.read()
-            cfg_items = yaml.load(yaml_content)
 
 
 legendName = [
@@ -11,7 +11,7 @@ if not exists("../config.yaml"):
 else:
     with open("../config.yaml", 'r', encoding='utf-8') as in_file:
         yaml_content = in_file.read()
-        cfg_items = yaml.load(yaml_content)
+        cfg_items = yaml.safe_load(yaml_content)
 
 
 def create_db():
@@ -55,6 +55,98 @@ def create_db():
             "index_id");
             
             grant delete, insert, references, select, trigger, truncate, update on weather_data to weatherman;
+            
+            create table weather_data_compacted
+            (
+                bucket_start       timestamp(0)   not null primary key,
+                sample_count       integer        not null,
+                tempindoor         numeric(8, 2)  not null,
+                humindoor          integer        not null,
+                tempoutdoor        numeric(8, 2)  not null,
+                humoutdoor         integer        not null,
+                dewindoor          numeric(8, 2)  not null,
+                dewoutdoor         numeric(8, 2)  not null,
+                "WindChill"        numeric(8, 2)  not null,
+                heatindex          numeric(8, 2)  not null,
+                temphumidwindindex numeric(8, 2)  not null,
+                barometer          numeric(10, 2) not null,
+                windspd            numeric(8, 2)  not null,
+                highwindspd        numeric(8, 2)  not null,
+                winddirection      smallint       not null,
+                avgwindspd         numeric(8, 2)  not null,
+                avgwinddir         numeric(8, 2)  not null,
+                rainrate           numeric(8, 2)  not null,
+                raindaily          numeric(8, 2)  not null,
+                solarrad           numeric(12, 2) not null,
+                uvindex            numeric(8, 2)  not null,
+                batterystate       varchar(32)    not null,
+                heat               numeric(8, 2)  not null
+            );
+            
+            alter table weather_data_compacted
+                owner to postgres;
+            
+            create view weather_history as
+            select index_id, localdatetime, tempindoor, humindoor, tempoutdoor, humoutdoor, dewindoor, dewoutdoor,
+                   "WindChill", heatindex, temphumidwindindex, barometer, windspd, highwindspd, winddirection,
+                   avgwindspd, avgwinddir, rainrate, raindaily, solarrad, uvindex, batterystate, heat
+            from weather_data
+            union all
+            select null::bigint, bucket_start, tempindoor, humindoor, tempoutdoor, humoutdoor, dewindoor, dewoutdoor,
+                   "WindChill", heatindex, temphumidwindindex, barometer, windspd, highwindspd, winddirection,
+                   avgwindspd, avgwinddir, rainrate, raindaily, solarrad, uvindex, batterystate, heat
+            from weather_data_compacted;
+            
+            alter view weather_history
+                owner to postgres;
+            
+            grant delete, insert, select, update on weather_data_compacted to weatherman;
+            grant select on weather_history to weatherman;
+            
+            create table weather_derived
+            (
+                index_id             bigint         not null primary key
+                    references weather_data (index_id) on delete cascade,
+                localdatetime        timestamp(0)   not null,
+                feels_like           numeric(8, 2)  not null,
+                pressure_tendency_3h numeric(8, 2),
+                rain_1h              numeric(8, 2)  not null,
+                rain_24h             numeric(8, 2)  not null,
+                wind_run_today       numeric(10, 2) not null
+            );
+            
+            alter table weather_derived
+                owner to postgres;
+            CREATE INDEX "idx_derived_ldt" ON "public"."weather_derived" USING btree (
+            "localdatetime");
+            
+            grant delete, insert, references, select, trigger, truncate, update on weather_derived to weatherman;
+            
+            create table weather_anomaly
+            (
+                index_id      bigint       not null references weather_data (index_id) on delete cascade,
+                localdatetime timestamp(0) not null,
+                metric        varchar(32)  not null,
+                value         numeric(12, 2),
+                reason        text         not null,
+                primary key (index_id, metric)
+            );
+            
+            create table weather_data_quarantine
+            (
+                quarantine_id bigserial    not null primary key,
+                localdatetime timestamp(0) not null,
+                observation   jsonb        not null,
+                reasons       text         not null
+            );
+            
+            alter table weather_anomaly
+                owner to postgres;
+            alter table weather_data_quarantine
+                owner to postgres;
+            
+            grant delete, insert, references, select, trigger, truncate, update on weather_anomaly to weatherman;
+            grant delete, insert, references, select, trigger, truncate, update on weather_data_quarantine to weatherman;
             grant ALL PRIVILEGES on ALL SEQUENCES IN SCHEMA public TO weatherman;
             """)
     except:
@@ -1,89 +1,185 @@
+import asyncio
+import threading
+
 import psycopg
 from fastapi import Query
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
 
 from scripts.configs import GlobalConfig
+from scripts.queries import queries
 
 
-async def query_db_by_time(sql_query_str: str,
-                           start_timestamp: str = Query(None, alias="startTime"),
-                           end_timestamp: str = Query(None, alias="endTime")):
-    global db_conn
+# Two kinds of connections:
+# - db_conn, the writer: only used by the ingest code on the event loop thread, which runs every
+#   execute ... commit without awaiting in between, so no other caller can have work pending in its transaction.
+#   It is (re)connected off the loop by connect_writer first, the check_db in run_query only finds it connected.
+# - read_pool: autocommit connections for everything that runs in worker threads (chart queries, the startup
+#   seeding, DDL). A failing reader only affects its own connection, the pool replaces broken ones.
+def run_query(query_name: str, params: dict = None):
+    # prepare=True: every registered statement is prepared on its first use on a connection and reused after.
     check_db()
+    return db_conn.cursor().execute(queries[query_name], params, prepare=True)
+
+
+def fetch_all(query_name: str, params: dict = None):
+    with get_read_pool().connection() as conn:
+        return conn.execute(queries[query_name], params, prepare=True).fetchall()
+
+
+def fetch_one(query_name: str, params: dict = None):
+    with get_read_pool().connection() as conn:
+        return conn.execute(queries[query_name], params, prepare=True).fetchone()
+
+
+# The async queries run in a worker thread, so the event loop keeps serving while the database works
+# (and identical concurrent requests can be coalesced, see scripts/single_flight.py).
+async def query_recent(kind: str, interval=None):
+    if interval is None:
+        return await asyncio.to_thread(fetch_all, kind + "_all")
+    return await asyncio.to_thread(fetch_all, kind + "_since", {"interval": interval})
 
+
+async def query_db_by_time(kind: str,
+                           start_timestamp: str = Query(None, alias="startTime"),
+                           end_timestamp: str = Query(None, alias="endTime")):
     try:
-        result = db_conn.cursor().execute(sql_query_str, {
+        return await asyncio.to_thread(fetch_all, kind + history_suffix, {
             "sttms": start_timestamp,
             "edtms": end_timestamp
-        }, prepare=True)
+        })
     except Exception as e:
-        db_conn.close()
         return str(e)
 
-    return result.fetchall()
-
 
 async def get_raw_wind_by_time(start_timestamp: str = Query(None, alias="startTime"),
                                end_timestamp: str = Query(None, alias="endTime")):
-    return await query_db_by_time("SELECT localdatetime AS \"Time\", "
-                                  " windspd AS \"Speed\", highwindspd AS \"Gust\", "
-                                  " winddirection as \"Direction\" FROM weather_data "
-                                  "WHERE localdatetime between (%(sttms)s) and (%(edtms)s) "
-                                  "ORDER BY localdatetime DESC",
+    return await query_db_by_time("wind",
                                   start_timestamp=start_timestamp,
                                   end_timestamp=end_timestamp)
 
 
 async def get_raw_rain_by_time(start_timestamp: str = Query(None, alias="startTime"),
                                end_timestamp: str = Query(None, alias="endTime")):
-    return await query_db_by_time("SELECT localdatetime AS \"Time\", "
-                                  "rainrate as \"Rain\" FROM weather_data  "
-                                  "WHERE localdatetime between (%(sttms)s) and (%(edtms)s) "
-                                  "ORDER BY localdatetime DESC",
+    return await query_db_by_time("rain",
                                   start_timestamp=start_timestamp,
                                   end_timestamp=end_timestamp)
 
 
 async def get_raw_temp_by_time(start_timestamp: str = Query(None, alias="startTime"),
                                end_timestamp: str = Query(None, alias="endTime")):
-    return await query_db_by_time("SELECT localdatetime AS \"Time\", "
-                                  " tempoutdoor as \"TempOut\", tempindoor AS \"TempIn\" FROM weather_data "
-                                  "WHERE localdatetime BETWEEN (%(sttms)s) AND (%(edtms)s) "
-                                  " ORDER BY localdatetime DESC",
+    return await query_db_by_time("temperature",
                                   start_timestamp=start_timestamp,
                                   end_timestamp=end_timestamp)
 
 
 async def get_raw_barometer_by_time(start_timestamp: str = Query(None, alias="startTime"),
                                     end_timestamp: str = Query(None, alias="endTime")):
-    return await query_db_by_time("SELECT localdatetime AS \"Time\", "
-                                  " barometer as \"Baro\", index_id FROM weather_data "
-                                  "WHERE localdatetime BETWEEN (%(sttms)s) AND (%(edtms)s) "
-                                  "ORDER BY localdatetime DESC",
+    return await query_db_by_time("barometer",
                                   start_timestamp=start_timestamp,
                                   end_timestamp=end_timestamp)
 
 
 async def get_raw_solar_by_time(start_timestamp: str = Query(None, alias="startTime"),
                                 end_timestamp: str = Query(None, alias="endTime")):
-    return await query_db_by_time("SELECT localdatetime AS \"Time\", "
-                                  "solarrad as \"Solar\", index_id FROM weather_data "
-                                  "WHERE localdatetime BETWEEN (%(sttms)s) AND (%(edtms)s) "
-                                  "ORDER BY localdatetime DESC",
+    return await query_db_by_time("solar",
                                   start_timestamp=start_timestamp,
                                   end_timestamp=end_timestamp)
 
 
+def use_compacted_history(enabled: bool):
+    # the weather_history view unions the raw rows with the compacted buckets, see scripts/retention.py
+    global history_suffix
+    history_suffix = "_by_time_history" if enabled else "_by_time"
+
+
+def detect_compacted_history():
+    # the view outlives the process, compacted ranges stay visible from the start and not only after a retention run
+    use_compacted_history(fetch_one("history_available")["available"])
+
+
+def get_connect_timeout():
+    # seconds, an unreachable database host fails fast instead of after the TCP timeout
+    return int(GlobalConfig.cfg["database"].get("connect_timeout", 5))
+
+
+async def connect_writer():
+    # (re)connects the writer in a worker thread, run_query on the event loop then finds it connected
+    await asyncio.to_thread(check_db)
+
+
 def check_db():
+    # connects on first use, so the app starts (and reloads) without waiting for the database.
     global db_conn
-    if db_conn.broken:
-        db_conn.close()
-        db_conn = psycopg.connect(GlobalConfig.cfg["database"]["connection_str"], row_factory=dict_row)
-        db_conn.prepare_threshold = 0
+    if db_conn is not None and not db_conn.broken and not db_conn.closed:
+        return
+
+    with db_connect_lock:
+        if db_conn is not None and db_conn.broken:
+            db_conn.close()
+
+        if db_conn is None or db_conn.closed:
+            db_conn = psycopg.connect(GlobalConfig.cfg["database"]["connection_str"], row_factory=dict_row,
+                                      connect_timeout=get_connect_timeout())
+
+
+def get_read_pool():
+    # created on first use like db_conn, database.read_pool_size connections at most
+    global read_pool
+    if read_pool is None:
+        with db_connect_lock:
+            if read_pool is None:
+                read_pool = ConnectionPool(GlobalConfig.cfg["database"]["connection_str"], min_size=1,
+                                           max_size=int(GlobalConfig.cfg["database"].get("read_pool_size", 4)),
+                                           kwargs={"row_factory": dict_row, "autocommit": True,
+                                                   "connect_timeout": get_connect_timeout()}, open=True)
+    return read_pool
 
-    if db_conn.closed:
-        db_conn = psycopg.connect(GlobalConfig.cfg["database"]["connection_str"], row_factory=dict_row)
-        db_conn.prepare_threshold = 0
+
+def commit_db():
+    if db_conn is not None:
+        db_conn.commit()
+
+
+def rollback_db():
+    # writer only, see run_query
+    if db_conn is not None:
+        try:
+            db_conn.rollback()
+        except psycopg.Error:
+            db_conn.close()
+
+
+def relation_exists(conn, name: str) -> bool:
+    return conn.execute(queries["relation_exists"], {"name": name}, prepare=True).fetchone()["exists"]
+
+
+def ensure_table(create_sql: str, *relations: str):
+    """
+    Runs create_sql unless all the relations exist already. Postgres checks ownership before IF NOT EXISTS,
+    so the DDL fails for the app user on tables create_db.py created; it only helps databases created before.
+    """
+    # DDL can't be prepared, so it doesn't go through fetch_all. Autocommit: a failure leaves nothing to roll back.
+    try:
+        with get_read_pool().connection() as conn:
+            if all(relation_exists(conn, name) for name in relations):
+                return
+            conn.execute(create_sql)
+    except psycopg.Error as ex:
+        print("Could not create table: " + str(ex))
+
+
+def close_db():
+    # at shutdown
+    global read_pool
+    if db_conn is not None:
+        db_conn.close()
+    if read_pool is not None:
+        read_pool.close()
+        read_pool = None
 
 
-db_conn = psycopg.connect(GlobalConfig.cfg["database"]["connection_str"], row_factory=dict_row)
+history_suffix = "_by_time"
+db_conn = None
+read_pool = None
+db_connect_lock = threading.Lock()
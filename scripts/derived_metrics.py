@@ -0,0 +1,147 @@
+from collections import deque
+from datetime import timedelta
+
+# Samples further apart than this are not integrated over (station offline / restarted).
+max_integration_gap = timedelta(minutes=10)
+pressure_tendency_window = timedelta(hours=3)
+# the oldest sample has to be at least this old for the 3h tendency to be reported
+pressure_tendency_min_span = timedelta(hours=2, minutes=50)
+
+
+class WindowSum:
+    # running sum over a time window, O(1) amortized per sample
+    def __init__(self, window: timedelta):
+        self.window = window
+        self.items = deque()
+        self.total = 0.0
+
+    def add(self, time, value: float):
+        self.items.append((time, value))
+        self.total += value
+        self.expire(time)
+
+    def expire(self, now):
+        while self.items and self.items[0][0] <= now - self.window:
+            self.total -= self.items.popleft()[1]
+        if not self.items:
+            self.total = 0.0
+
+
+class DerivedMetricsState:
+    """
+    Incremental state for the values derived from the observation stream. update() is called once per
+    stored observation and returns the derived values for it, nothing is recomputed from the table later.
+    """
+
+    def __init__(self):
+        self.last_time = None
+        self.last_wind_speed = 0.0
+        self.last_rain_rate = 0.0
+        self.pressure_samples = deque()
+        self.rain_1h = WindowSum(timedelta(hours=1))
+        self.rain_24h = WindowSum(timedelta(hours=24))
+        self.wind_run_day = None
+        self.wind_run_km = 0.0
+        self.sample_count = 0
+        self.last_metrics = None
+
+    def update(self, time, temp_out: float, heat_index: float, wind_chill: float, wind_speed: float,
+               rain_rate: float, barometer: float, flagged=()):
+        """
+        wind_speed in m/s, rain_rate in mm/h, barometer in hPa. Returns the derived metrics dict.
+        flagged: the metrics (keys of the "insert_observation" parameters, see scripts/anomaly.py) flagged as
+        glitches, the last good value is held for them instead of integrating the bad one.
+        """
+        if "wind_spd" in flagged:
+            wind_speed = self.last_wind_speed
+        if "rainrate" in flagged:
+            rain_rate = self.last_rain_rate
+
+        if self.wind_run_day != time.date():
+            self.wind_run_day = time.date()
+            self.wind_run_km = 0.0
+
+        if self.last_time is not None and timedelta(0) < time - self.last_time <= max_integration_gap:
+            # the previous reading held until this one
+            seconds = (time - self.last_time).total_seconds()
+            self.wind_run_km += self.last_wind_speed * seconds / 1000
+            rain_mm = self.last_rain_rate * seconds / 3600
+            self.rain_1h.add(time, rain_mm)
+            self.rain_24h.add(time, rain_mm)
+        else:
+            self.rain_1h.expire(time)
+            self.rain_24h.expire(time)
+
+        if "baro" not in flagged:
+            self.pressure_samples.append((time, barometer))
+        while self.pressure_samples and self.pressure_samples[0][0] < time - pressure_tendency_window:
+            self.pressure_samples.popleft()
+        pressure_tendency = None
+        if self.pressure_samples:
+            oldest_time, oldest_barometer = self.pressure_samples[0]
+            if time - oldest_time >= pressure_tendency_min_span:
+                pressure_tendency = round(self.pressure_samples[-1][1] - oldest_barometer, 2)
+
+        if self.last_metrics is not None and ("temp_out" in flagged or "wind_spd" in flagged):
+            # the station's heat index / wind chill are computed from the same bad reading
+            feels = self.last_metrics["feels_like"]
+        else:
+            feels = feels_like(temp_out, heat_index, wind_chill, wind_speed)
+
+        self.last_time = time
+        self.last_wind_speed = wind_speed
+        self.last_rain_rate = rain_rate
+        self.sample_count += 1
+
+        self.last_metrics = {
+            "feels_like": feels,
+            "pressure_tendency_3h": pressure_tendency,
+            "rain_1h": round(self.rain_1h.total, 2),
+            "rain_24h": round(self.rain_24h.total, 2),
+            "wind_run_today": round(self.wind_run_km, 2)
+        }
+        return self.last_metrics
+
+    def update_from_observation(self, observation: dict, flagged=()):
+        # observation is the parameter dict of the "insert_observation" query
+        return self.update(observation["dateobj"], observation["temp_out"], observation["heatindex"],
+                           observation["chill_idx"], observation["wind_spd"], observation["rainrate"],
+                           observation["baro"], flagged)
+
+    def update_from_row(self, row):
+        # row as returned by the "derived_seed" query
+        return self.update(row["Time"], float(row["tempoutdoor"]), float(row["heatindex"]),
+                           float(row["WindChill"]), float(row["windspd"]), float(row["rainrate"]),
+                           float(row["barometer"]), set(row["flagged"]))
+
+
+def feels_like(temp_out: float, heat_index: float, wind_chill: float, wind_speed: float):
+    # the station computes heat index and wind chill, pick the one that applies (NWS thresholds)
+    if temp_out >= 26.7:
+        return heat_index
+    if temp_out <= 10 and wind_speed > 1.34:
+        return wind_chill
+    return temp_out
+
+
+derived_state = DerivedMetricsState()
+
+
+def update_derived(observation: dict, flagged=()):
+    return derived_state.update_from_observation(observation, flagged)
+
+
+def seed_derived_state(rows):
+    """
+    Replays the last 24 hours of observations (oldest first) into a fresh state. Skipped if observations
+    were already received since the start, their state is newer than the database rows fetched before.
+    """
+    global derived_state
+    if derived_state.sample_count > 0:
+        return derived_state.last_metrics
+
+    state = DerivedMetricsState()
+    for row in rows:
+        state.update_from_row(row)
+    derived_state = state
+    return state.last_metrics
@@ -74,20 +74,13 @@ def get_dir_from_angle(angle: int):
         return 15  # NNW
 
 
-def get_interval_where_str(prior_days, prior_hrs):
-    interval_str = ""
+def get_interval(prior_days, prior_hrs):
+    # passed to the database as a bound interval parameter, see scripts/queries.py
     if prior_days is not None:
-        interval_str = " " + str(prior_days) + " DAYS"
-    else:
-        if prior_hrs is not None:
-            interval_str = interval_str + " " + str(prior_hrs) + " HOURS"
-
-    if interval_str != "":
-        where_str = " WHERE localdatetime > CURRENT_TIMESTAMP - INTERVAL '{intv_str}'"
-        where_str = where_str.format_map({"intv_str": interval_str})
-    else:
-        where_str = ""
-    return where_str
+        return timedelta(days=prior_days)
+    if prior_hrs is not None:
+        return timedelta(hours=prior_hrs)
+    return None
 
 
 def process_wind_data(raw_data, window_size: int):
@@ -0,0 +1,161 @@
+import logging
+import logging.handlers
+import queue
+import sys
+
+from scripts.configs import GlobalConfig
+
+# Query parameters of the Weathercloud /v01/set call:
+# (query parameter, key in the "insert_observation" parameters, divisor). The station sends tenths for the
+# scaled values, None means the value is stored as sent.
+observation_fields = (
+    ("tempin", "temp_in", 10),
+    ("humin", "hum_in", None),
+    ("temp", "temp_out", 10),
+    ("hum", "hum_out", None),
+    ("dewin", "dew_in", 10),
+    ("dew", "dew_out", 10),
+    ("chill", "chill_idx", 10),
+    ("heatin", "heatindex", 10),
+    ("heat", "heat", 10),
+    ("thw", "thw_idx", 10),
+    ("bar", "baro", 10),
+    ("wspd", "wind_spd", 10),
+    ("wspdhi", "high_wind", 10),
+    ("wdir", "wind_dir", None),
+    ("wspdavg", "avg_wind_spd", 10),
+    ("wdiravg", "avg_wind_dir", None),
+    ("rainrate", "rainrate", 10),
+    ("rain", "raindaily", 10),
+    ("solarrad", "solar_rad", 10),
+    ("uvi", "uvi", None),
+)
+
+# Required by the Weathercloud protocol, not stored.
+required_text_fields = ("wid", "key")
+
+# Sanity rules applied to the parsed (already divided) values, samples breaking one of them are dropped.
+# Overridden by ingest.rules in config.yaml.
+default_sanity_rules = {
+    "temp_in": {"min": -100},
+    "temp_out": {"min": -100},
+    "heatindex": {"min": -100},
+    "thw_idx": {"min": -100},
+    "dew_in": {"min": -100},
+    "dew_out": {"min": -100},
+    "solar_rad": {"min": -100}
+}
+
+ingest_logger = logging.getLogger("weather.ingest")
+ingest_log_listener = None
+
+compiled_rules = None
+
+
+def compile_sanity_rules(rules) -> tuple:
+    """
+    Turns ingest.rules into (key, min, max) tuples. Broken entries are reported and skipped, an empty entry
+    ("temp_in:") has no limits.
+    """
+    if not isinstance(rules, dict):
+        print("ingest.rules has to be a mapping of field: {min: ..., max: ...}, using the defaults")
+        rules = default_sanity_rules
+
+    known_keys = {key for _, key, _ in observation_fields}
+    compiled = []
+    for key, rule in rules.items():
+        rule = rule or {}
+        if key not in known_keys:
+            print("ingest.rules: unknown field {}, skipped".format(key))
+            continue
+        if not isinstance(rule, dict):
+            print("ingest.rules: {} has to be a mapping like {{min: ..., max: ...}}, skipped".format(key))
+            continue
+        limits = (rule.get("min"), rule.get("max"))
+        if any(limit is not None and (isinstance(limit, bool) or not isinstance(limit, (int, float)))
+               for limit in limits):
+            print("ingest.rules: {} min / max have to be numbers, skipped".format(key))
+            continue
+        if limits != (None, None):
+            compiled.append((key,) + limits)
+    return tuple(compiled)
+
+
+def get_sanity_rules():
+    # compiled once, called at startup so broken entries are reported before the first upload
+    global compiled_rules
+    if compiled_rules is None:
+        rules = (GlobalConfig.cfg.get("ingest") or {}).get("rules") or default_sanity_rules
+        compiled_rules = compile_sanity_rules(rules)
+    return compiled_rules
+
+
+def parse_observation(params, observation_time) -> dict:
+    """
+    Turns the /v01/set query parameters into the parameter dict of the "insert_observation" query.
+    Raises ValueError naming the parameter if one is missing or not an integer.
+    """
+    for name in required_text_fields:
+        if name not in params:
+            raise ValueError("missing parameter " + name)
+
+    observation = {"dateobj": observation_time}
+    for name, key, divisor in observation_fields:
+        raw = params.get(name)
+        if raw is None:
+            raise ValueError("missing parameter " + name)
+        try:
+            value = int(raw)
+        except ValueError:
+            raise ValueError("parameter {} is not an integer: {}".format(name, raw)) from None
+        observation[key] = value if divisor is None else value / divisor
+
+    battery = params.get("battery")
+    if battery is None:
+        raise ValueError("missing parameter battery")
+    observation["batt"] = battery
+    return observation
+
+
+def check_sanity(observation: dict):
+    """
+    Returns a description of the first broken sanity rule, None if the observation is plausible.
+    """
+    for key, min_value, max_value in get_sanity_rules():
+        value = observation.get(key)
+        if value is None:
+            continue
+        if min_value is not None and value < min_value:
+            return "{}={} below {}".format(key, value, min_value)
+        if max_value is not None and value > max_value:
+            return "{}={} above {}".format(key, value, max_value)
+    return None
+
+
+def log_ingest(event: str, **fields):
+    # one key=value line per event, written by the listener thread so the request never waits for stdout
+    if ingest_logger.isEnabledFor(logging.INFO):
+        ingest_logger.info("event=%s %s", event, " ".join("{}={}".format(k, v) for k, v in fields.items()))
+
+
+def start_ingest_logging():
+    global ingest_log_listener
+    if ingest_log_listener is not None:
+        return
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    ingest_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    ingest_logger.setLevel(logging.INFO)
+    ingest_logger.propagate = False
+    ingest_log_listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    ingest_log_listener.start()
+
+
+def stop_ingest_logging():
+    global ingest_log_listener
+    if ingest_log_listener is not None:
+        ingest_log_listener.stop()
+        ingest_log_listener = None
+        for handler in list(ingest_logger.handlers):
+            ingest_logger.removeHandler(handler)
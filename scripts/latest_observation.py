@@ -0,0 +1,110 @@
+import json
+import threading
+from decimal import Decimal
+
+from scripts.helper_functions import altitude_fix
+
+knots_factor = Decimal("1.9438444924")
+
+# The newest observation, same keys as the "latest" query in scripts/queries.py (without barometer_abs).
+# Refreshed by /v01/set on every upload, so /api/latest never has to go to the database.
+latest_record = None
+# derived metrics of the newest observation, see scripts/derived_metrics.py. Appended to the response.
+latest_derived = {}
+
+# altitude -> the /api/latest response body, built on first request for that altitude after every refresh.
+serialized_cache = {}
+serialized_cache_size = 16
+# the startup seed runs in a worker thread while uploads already come in on the event loop
+latest_lock = threading.Lock()
+
+
+def json_number(value):
+    if isinstance(value, Decimal):
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    return value
+
+
+def set_latest(record: dict, only_if_newer=False):
+    global latest_record, serialized_cache
+    with latest_lock:
+        # "Time" is 'YYYY-MM-DD HH24:MI:SS', the strings compare in time order
+        if only_if_newer and latest_record is not None and latest_record["Time"] >= record["Time"]:
+            return
+        latest_record = {key: json_number(value) for key, value in record.items()}
+        # swap in a new dict instead of clearing, a request serializing right now keeps the old one.
+        serialized_cache = {}
+
+
+def set_latest_derived(metrics):
+    global latest_derived, serialized_cache
+    latest_derived = dict(metrics or {})
+    serialized_cache = {}
+
+
+def set_latest_from_row(row):
+    # row as returned by the "latest" query. Its query may have started before an upload that is already set,
+    # the older database row must not replace it.
+    if row is not None:
+        set_latest(row, only_if_newer=True)
+
+
+def set_latest_from_observation(observation: dict):
+    # observation is the parameter dict of the "insert_observation" query
+    def dec(name):
+        return Decimal(str(observation[name]))
+
+    set_latest({
+        "Time": observation["dateobj"].strftime('%Y-%m-%d %H:%M:%S'),
+        "tempindoor": dec("temp_in"),
+        "humindoor": observation["hum_in"],
+        "tempoutdoor": dec("temp_out"),
+        "humoutdoor": observation["hum_out"],
+        "dewindoor": dec("dew_in"),
+        "dewoutdoor": dec("dew_out"),
+        "WindChill": dec("chill_idx"),
+        "heatindex": dec("heatindex"),
+        "temphumidwindindex": dec("thw_idx"),
+        "barometer": dec("baro"),
+        "windspd": round(dec("wind_spd") * knots_factor, 2),
+        "highwindspd": round(dec("high_wind") * knots_factor, 2),
+        "winddirection": observation["wind_dir"],
+        "avgwindspd": round(dec("avg_wind_spd"), 2),
+        "avgwinddir": dec("avg_wind_dir"),
+        "rainrate": dec("rainrate"),
+        "raindaily": dec("raindaily"),
+        "solarrad": dec("solar_rad"),
+        "uvindex": Decimal(observation["uvi"]) / 10,
+        "heat": dec("heat")
+    })
+
+
+def get_latest_bytes(altitude):
+    """
+    Returns the serialized /api/latest body for the altitude, or None if no observation is known yet.
+    """
+    record = latest_record
+    if record is None:
+        return None
+    if altitude is None:
+        altitude = 0
+
+    cache = serialized_cache
+    body = cache.get(altitude)
+    if body is not None:
+        return body
+
+    # keep the column order of the old query, barometer_abs right after barometer
+    response = {}
+    for key, value in record.items():
+        response[key] = value
+        if key == "barometer":
+            response["barometer_abs"] = value
+            if altitude != 0:
+                response["barometer_abs"] = float(round(altitude_fix(Decimal(str(value)), altitude), 1))
+    response.update(latest_derived)
+
+    body = json.dumps(response, separators=(",", ":")).encode("utf-8")
+    if len(cache) < serialized_cache_size:
+        cache[altitude] = body
+    return body
@@ -0,0 +1,161 @@
+# All the SQL the site runs, as fixed statements with bound parameters only.
+# Every statement text is constant, so psycopg prepares it once per connection and Postgres reuses the plan.
+
+select_columns = {
+    "wind": "localdatetime AS \"Time\", windspd AS \"Speed\", highwindspd AS \"Gust\", "
+            "winddirection AS \"Direction\"",
+    "rain": "localdatetime AS \"Time\", rainrate AS \"Rain\"",
+    "temperature": "localdatetime AS \"Time\", tempoutdoor AS \"TempOut\", tempindoor AS \"TempIn\"",
+    "barometer": "localdatetime AS \"Time\", barometer AS \"Baro\", index_id",
+    "solar": "localdatetime AS \"Time\", solarrad AS \"Solar\", index_id"
+}
+
+queries = {}
+
+for kind, columns in select_columns.items():
+    # whole table, used when neither priorDays nor priorHrs is given
+    queries[kind + "_all"] = \
+        "SELECT " + columns + " FROM weather_data ORDER BY localdatetime DESC"
+    # %(interval)s is a datetime.timedelta, sent as an interval parameter
+    queries[kind + "_since"] = \
+        "SELECT " + columns + " FROM weather_data " \
+                              "WHERE localdatetime > CURRENT_TIMESTAMP - %(interval)s " \
+                              "ORDER BY localdatetime DESC"
+    queries[kind + "_by_time"] = \
+        "SELECT " + columns + " FROM weather_data " \
+                              "WHERE localdatetime BETWEEN %(sttms)s AND %(edtms)s " \
+                              "ORDER BY localdatetime DESC"
+    # same as above, but including the compacted buckets, see scripts/retention.py
+    queries[kind + "_by_time_history"] = \
+        "SELECT " + columns + " FROM weather_history " \
+                              "WHERE localdatetime BETWEEN %(sttms)s AND %(edtms)s " \
+                              "ORDER BY localdatetime DESC"
+
+# whether a table / view / index exists, checked before the DDL the app runs for older databases
+queries["relation_exists"] = "SELECT to_regclass(%(name)s) IS NOT NULL AS exists"
+
+# whether the weather_history view (raw + compacted rows, see scripts/retention.py) exists
+queries["history_available"] = "SELECT to_regclass('weather_history') IS NOT NULL AS available"
+
+# The altitude correction of the barometer is done in python, see helper_functions.altitude_fix
+queries["latest"] = """SELECT
+        to_char(weather_data.localdatetime, 'YYYY-MM-DD HH24:MI:SS') AS "Time",
+        weather_data.tempindoor,
+        weather_data.humindoor,
+        weather_data.tempoutdoor,
+        weather_data.humoutdoor,
+        weather_data.dewindoor,
+        weather_data.dewoutdoor,
+        weather_data."WindChill",
+        weather_data.heatindex,
+        weather_data.temphumidwindindex,
+        weather_data.barometer,
+        ROUND(weather_data.windspd*1.9438444924, 2) as "windspd",
+        ROUND(weather_data.highwindspd*1.9438444924, 2) as "highwindspd",
+        weather_data.winddirection,
+        ROUND(weather_data.avgwindspd,2) as "avgwindspd",
+        weather_data.avgwinddir,
+        weather_data.rainrate,
+        weather_data.raindaily,
+        weather_data.solarrad,
+        weather_data.uvindex / 10 as "uvindex",
+        weather_data.heat
+    FROM
+        weather_data
+    ORDER BY
+        weather_data.localdatetime DESC
+    LIMIT 1"""
+
+queries["insert_observation"] = """
+            INSERT INTO "weather_data"
+            ("localdatetime", "tempindoor", "humindoor", "tempoutdoor", "humoutdoor", "dewindoor",
+            "dewoutdoor", "WindChill", "heatindex", "temphumidwindindex", "barometer", "windspd",
+            "highwindspd", "winddirection", "avgwindspd", "avgwinddir", "rainrate", "raindaily",
+            "solarrad", "uvindex", "batterystate", "heat" )
+             VALUES
+             (%(dateobj)s, %(temp_in)s, %(hum_in)s, %(temp_out)s, %(hum_out)s, %(dew_in)s,
+             %(dew_out)s, %(chill_idx)s, %(heatindex)s, %(thw_idx)s, %(baro)s, %(wind_spd)s,
+             %(high_wind)s, %(wind_dir)s, %(avg_wind_spd)s, %(avg_wind_dir)s, %(rainrate)s, %(raindaily)s ,
+             %(solar_rad)s, %(uvi)s, %(batt)s, %(heat)s)
+             RETURNING index_id;
+        """
+
+# Derived metrics, one row per stored observation, see scripts/derived_metrics.py
+create_derived_table_sql = """
+    CREATE TABLE IF NOT EXISTS weather_derived
+    (
+        index_id             bigint        not null primary key
+            references weather_data (index_id) on delete cascade,
+        localdatetime        timestamp(0)  not null,
+        feels_like           numeric(8, 2) not null,
+        pressure_tendency_3h numeric(8, 2),
+        rain_1h              numeric(8, 2) not null,
+        rain_24h             numeric(8, 2) not null,
+        wind_run_today       numeric(10, 2) not null
+    );
+    CREATE INDEX IF NOT EXISTS idx_derived_ldt ON weather_derived USING btree (localdatetime);
+"""
+
+queries["insert_derived"] = """
+    INSERT INTO weather_derived
+    (index_id, localdatetime, feels_like, pressure_tendency_3h, rain_1h, rain_24h, wind_run_today)
+    VALUES
+    (%(index_id)s, %(dateobj)s, %(feels_like)s, %(pressure_tendency_3h)s, %(rain_1h)s, %(rain_24h)s,
+     %(wind_run_today)s)
+"""
+
+derived_columns = "localdatetime AS \"Time\", feels_like, pressure_tendency_3h, rain_1h, rain_24h, wind_run_today"
+queries["derived_all"] = "SELECT " + derived_columns + " FROM weather_derived ORDER BY localdatetime DESC"
+queries["derived_since"] = "SELECT " + derived_columns + " FROM weather_derived " \
+                                                         "WHERE localdatetime > CURRENT_TIMESTAMP - %(interval)s " \
+                                                         "ORDER BY localdatetime DESC"
+
+# the observations the derived metrics state is rebuilt from at startup, oldest first, with their flagged metrics
+queries["derived_seed"] = """
+    SELECT localdatetime AS "Time", tempoutdoor, heatindex, "WindChill", windspd, rainrate, barometer,
+           ARRAY(SELECT metric FROM weather_anomaly WHERE weather_anomaly.index_id = weather_data.index_id)
+               AS flagged
+    FROM weather_data
+    WHERE localdatetime > CURRENT_TIMESTAMP - INTERVAL '24 hours'
+    ORDER BY localdatetime ASC
+"""
+
+# Anomaly detection, see scripts/anomaly.py
+create_anomaly_tables_sql = """
+    CREATE TABLE IF NOT EXISTS weather_anomaly
+    (
+        index_id      bigint       not null references weather_data (index_id) on delete cascade,
+        localdatetime timestamp(0) not null,
+        metric        varchar(32)  not null,
+        value         numeric(12, 2),
+        reason        text         not null,
+        primary key (index_id, metric)
+    );
+    CREATE TABLE IF NOT EXISTS weather_data_quarantine
+    (
+        quarantine_id bigserial    not null primary key,
+        localdatetime timestamp(0) not null,
+        observation   jsonb        not null,
+        reasons       text         not null
+    );
+"""
+
+queries["insert_anomaly"] = """
+    INSERT INTO weather_anomaly (index_id, localdatetime, metric, value, reason)
+    VALUES (%(index_id)s, %(dateobj)s, %(metric)s, %(value)s, %(reason)s)
+    ON CONFLICT (index_id, metric) DO UPDATE SET value = excluded.value, reason = excluded.reason
+"""
+
+queries["insert_quarantine"] = """
+    INSERT INTO weather_data_quarantine (localdatetime, observation, reasons)
+    VALUES (%(dateobj)s, %(observation)s::jsonb, %(reasons)s)
+"""
+
+# the observations the anomaly detectors are warmed up with at startup, oldest first
+queries["anomaly_seed"] = """
+    SELECT tempindoor, humindoor, tempoutdoor, humoutdoor, dewindoor, dewoutdoor, barometer, windspd,
+           highwindspd, avgwindspd, rainrate, solarrad, uvindex
+    FROM weather_data
+    WHERE localdatetime > CURRENT_TIMESTAMP - INTERVAL '24 hours'
+    ORDER BY localdatetime ASC
+"""
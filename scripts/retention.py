@@ -0,0 +1,250 @@
+import asyncio
+import time
+from datetime import datetime as dt, timedelta
+
+import psycopg
+from psycopg.rows import dict_row
+
+from scripts.configs import GlobalConfig
+from scripts.db_ops import use_compacted_history, relation_exists
+
+retention_defaults = {
+    "enabled": False,
+    "raw_days": 90,
+    "bucket": "hour",
+    "chunk_hours": 24,
+    "pause_seconds": 1.0,
+    "run_interval_hours": 24
+}
+
+# Report of the last finished retention run, kept for logging / inspection.
+last_report = {}
+
+create_compacted_table_sql = """
+    CREATE TABLE IF NOT EXISTS weather_data_compacted
+    (
+        bucket_start       timestamp(0)   not null primary key,
+        sample_count       integer        not null,
+        tempindoor         numeric(8, 2)  not null,
+        humindoor          integer        not null,
+        tempoutdoor        numeric(8, 2)  not null,
+        humoutdoor         integer        not null,
+        dewindoor          numeric(8, 2)  not null,
+        dewoutdoor         numeric(8, 2)  not null,
+        "WindChill"        numeric(8, 2)  not null,
+        heatindex          numeric(8, 2)  not null,
+        temphumidwindindex numeric(8, 2)  not null,
+        barometer          numeric(10, 2) not null,
+        windspd            numeric(8, 2)  not null,
+        highwindspd        numeric(8, 2)  not null,
+        winddirection      smallint       not null,
+        avgwindspd         numeric(8, 2)  not null,
+        avgwinddir         numeric(8, 2)  not null,
+        rainrate           numeric(8, 2)  not null,
+        raindaily          numeric(8, 2)  not null,
+        solarrad           numeric(12, 2) not null,
+        uvindex            numeric(8, 2)  not null,
+        batterystate       varchar(32)    not null,
+        heat               numeric(8, 2)  not null
+    );
+"""
+
+# Raw rows and compacted buckets exposed with the same column names, so the history queries
+# keep working for time ranges that have already been compacted.
+create_history_view_sql = """
+    CREATE OR REPLACE VIEW weather_history AS
+    SELECT index_id, localdatetime, tempindoor, humindoor, tempoutdoor, humoutdoor, dewindoor, dewoutdoor,
+           "WindChill", heatindex, temphumidwindindex, barometer, windspd, highwindspd, winddirection,
+           avgwindspd, avgwinddir, rainrate, raindaily, solarrad, uvindex, batterystate, heat
+    FROM weather_data
+    UNION ALL
+    SELECT NULL::bigint, bucket_start, tempindoor, humindoor, tempoutdoor, humoutdoor, dewindoor, dewoutdoor,
+           "WindChill", heatindex, temphumidwindindex, barometer, windspd, highwindspd, winddirection,
+           avgwindspd, avgwinddir, rainrate, raindaily, solarrad, uvindex, batterystate, heat
+    FROM weather_data_compacted;
+"""
+
+# averaged per bucket, weighted by sample_count when a bucket is merged with an already compacted one
+average_columns = ("tempindoor", "humindoor", "tempoutdoor", "humoutdoor", "dewindoor", "dewoutdoor", "\"WindChill\"",
+                   "heatindex", "temphumidwindindex", "barometer", "windspd", "avgwindspd", "rainrate", "solarrad",
+                   "uvindex", "heat")
+# directions in degrees, averaged as unit vectors (359 and 1 average to 0, not 180). column -> decimals
+direction_columns = {"winddirection": 0, "avgwinddir": 2}
+
+
+def direction_sql(sin_sum: str, cos_sum: str, digits: int):
+    return "(round((degrees(atan2({}, {})) + 360)::numeric, {}) %% 360)".format(sin_sum, cos_sum, digits)
+
+
+compact_chunk_sql = """
+    INSERT INTO weather_data_compacted
+    SELECT date_trunc(%(bucket)s, localdatetime) AS bucket_start,
+           count(*),
+           round(avg(tempindoor), 2), round(avg(humindoor)), round(avg(tempoutdoor), 2), round(avg(humoutdoor)),
+           round(avg(dewindoor), 2), round(avg(dewoutdoor), 2), round(avg("WindChill"), 2),
+           round(avg(heatindex), 2), round(avg(temphumidwindindex), 2), round(avg(barometer), 2),
+           round(avg(windspd), 2), max(highwindspd),
+           {winddirection},
+           round(avg(avgwindspd), 2), {avgwinddir},
+           round(avg(rainrate), 2), max(raindaily), round(avg(solarrad), 2), round(avg(uvindex), 2),
+           max(batterystate), round(avg(heat), 2)
+    FROM weather_data
+    WHERE localdatetime >= %(chunk_start)s AND localdatetime < %(chunk_end)s
+    GROUP BY 1
+    ON CONFLICT (bucket_start) DO UPDATE SET
+           sample_count = weather_data_compacted.sample_count + excluded.sample_count,
+           highwindspd = greatest(weather_data_compacted.highwindspd, excluded.highwindspd),
+           raindaily = greatest(weather_data_compacted.raindaily, excluded.raindaily),
+           batterystate = greatest(weather_data_compacted.batterystate, excluded.batterystate),
+           {merged_columns}
+""".format(
+    winddirection=direction_sql("avg(sin(radians(winddirection)))", "avg(cos(radians(winddirection)))", 0),
+    avgwinddir=direction_sql("avg(sin(radians(avgwinddir)))", "avg(cos(radians(avgwinddir)))", 2),
+    # rows uploaded late for an already compacted bucket are merged into it, never dropped
+    merged_columns=",\n           ".join(
+        ["{0} = round((weather_data_compacted.{0} * weather_data_compacted.sample_count "
+         "+ excluded.{0} * excluded.sample_count) / (weather_data_compacted.sample_count + excluded.sample_count), 2)"
+         .format(column) for column in average_columns] +
+        ["{0} = {1}".format(column, direction_sql(
+            "sin(radians(weather_data_compacted.{0})) * weather_data_compacted.sample_count "
+            "+ sin(radians(excluded.{0})) * excluded.sample_count".format(column),
+            "cos(radians(weather_data_compacted.{0})) * weather_data_compacted.sample_count "
+            "+ cos(radians(excluded.{0})) * excluded.sample_count".format(column), digits))
+         for column, digits in direction_columns.items()]))
+
+chunk_size_sql = """
+    SELECT count(*) AS row_count, coalesce(sum(pg_column_size(weather_data.*)), 0) AS row_bytes
+    FROM weather_data
+    WHERE localdatetime >= %(chunk_start)s AND localdatetime < %(chunk_end)s
+"""
+
+delete_chunk_sql = """
+    DELETE FROM weather_data WHERE localdatetime >= %(chunk_start)s AND localdatetime < %(chunk_end)s
+"""
+
+
+def get_retention_config():
+    cfg = dict(retention_defaults)
+    cfg.update(GlobalConfig.cfg.get("retention") or {})
+    return cfg
+
+
+def ensure_retention_tables(conn):
+    # create_db.py creates these already, this only helps databases created before the retention job existed.
+    # Only missing objects are created: Postgres checks ownership before IF NOT EXISTS / OR REPLACE.
+    try:
+        if not relation_exists(conn, "weather_data_compacted"):
+            conn.execute(create_compacted_table_sql)
+        if not relation_exists(conn, "weather_history"):
+            conn.execute(create_history_view_sql)
+    except psycopg.Error as ex:
+        print("Retention: could not create the compaction tables, using the existing ones: " + str(ex))
+
+
+def get_table_size(conn):
+    return conn.execute("SELECT pg_total_relation_size('weather_data') AS size").fetchone()["size"]
+
+
+bucket_lengths = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+
+def truncate_to_bucket(time, bucket: str):
+    # same boundaries as date_trunc(bucket, ...) in compact_chunk_sql
+    if bucket == "day":
+        return time.replace(hour=0, minute=0, second=0, microsecond=0)
+    return time.replace(minute=0, second=0, microsecond=0)
+
+
+def get_chunk_length(cfg: dict):
+    if cfg["bucket"] not in bucket_lengths:
+        raise ValueError("retention.bucket has to be one of: " + ", ".join(bucket_lengths))
+    chunk = timedelta(hours=int(cfg["chunk_hours"]))
+    # a bucket split over two chunks would be aggregated twice
+    if chunk <= timedelta(0) or chunk % bucket_lengths[cfg["bucket"]]:
+        raise ValueError("retention.chunk_hours has to be a multiple of one " + cfg["bucket"])
+    return chunk
+
+
+def get_compaction_cutoff(raw_days: int, bucket: str):
+    # only compact whole buckets, the bucket that straddles the cutoff stays raw.
+    return truncate_to_bucket(dt.now() - timedelta(days=raw_days), bucket)
+
+
+def compact_old_rows(pause_between_chunks=None):
+    """
+    Compacts all raw rows older than the configured retention window into weather_data_compacted.
+    Works chunk by chunk of whole buckets, each chunk aggregated and deleted in one transaction, so an
+    interrupted run never loses data. Returns a report dict with the reclaimed rows / bytes.
+    """
+    cfg = get_retention_config()
+    chunk = get_chunk_length(cfg)
+    cutoff = get_compaction_cutoff(int(cfg["raw_days"]), cfg["bucket"])
+    report = {
+        "started": dt.now(),
+        "cutoff": cutoff,
+        "rows_compacted": 0,
+        "buckets_written": 0,
+        "rows_bytes_reclaimed": 0,
+        "table_bytes_before": 0,
+        "table_bytes_after": 0
+    }
+
+    # autocommit, so every conn.transaction() below is a real transaction and VACUUM is allowed.
+    with psycopg.connect(GlobalConfig.cfg["database"]["connection_str"], row_factory=dict_row,
+                         autocommit=True) as conn:
+        ensure_retention_tables(conn)
+        report["table_bytes_before"] = get_table_size(conn)
+        oldest = conn.execute("SELECT min(localdatetime) AS oldest FROM weather_data").fetchone()["oldest"]
+
+        # chunks start and end on bucket boundaries, so every bucket is aggregated from all of its rows at once
+        chunk_start = None if oldest is None else truncate_to_bucket(oldest, cfg["bucket"])
+        while chunk_start is not None and chunk_start < cutoff:
+            chunk_end = min(chunk_start + chunk, cutoff)
+            params = {"bucket": cfg["bucket"], "chunk_start": chunk_start, "chunk_end": chunk_end}
+            with conn.transaction():
+                size_row = conn.execute(chunk_size_sql, params).fetchone()
+                buckets = conn.execute(compact_chunk_sql, params).rowcount
+                conn.execute(delete_chunk_sql, params)
+            report["rows_compacted"] += size_row["row_count"]
+            report["rows_bytes_reclaimed"] += int(size_row["row_bytes"])
+            report["buckets_written"] += buckets
+            chunk_start = chunk_end
+            if pause_between_chunks is not None:
+                pause_between_chunks()
+
+        if report["rows_compacted"] > 0:
+            conn.execute("VACUUM (ANALYZE) weather_data")
+        report["table_bytes_after"] = get_table_size(conn)
+
+    report["finished"] = dt.now()
+    return report
+
+
+async def run_retention():
+    global last_report
+    cfg = get_retention_config()
+    pause = float(cfg["pause_seconds"])
+
+    # The compaction blocks on the database, keep it off the event loop and sleep between
+    # chunks so the live queries get the database most of the time.
+    report = await asyncio.to_thread(compact_old_rows, lambda: time.sleep(pause))
+    last_report = report
+    # the weather_history view exists now, let the history queries read the compacted buckets too.
+    use_compacted_history(True)
+    print("Retention: compacted {} rows into {} buckets, reclaimed {} bytes of rows, table size {} -> {} bytes"
+          .format(report["rows_compacted"], report["buckets_written"], report["rows_bytes_reclaimed"],
+                  report["table_bytes_before"], report["table_bytes_after"]))
+    return report
+
+
+async def retention_loop():
+    cfg = get_retention_config()
+    interval = float(cfg["run_interval_hours"]) * 3600
+    while True:
+        try:
+            await run_retention()
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            print("Retention run failed: " + str(ex))
+        await asyncio.sleep(interval)
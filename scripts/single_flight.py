@@ -0,0 +1,47 @@
+import asyncio
+import functools
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: while a call with the same key is running, later callers wait
+    for it and get its result instead of running their own query. Nothing is cached after it finished.
+    """
+
+    def __init__(self):
+        self.in_flight = {}
+        self.calls = 0
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key, coro_func, *args):
+        self.calls += 1
+        task = self.in_flight.get(key)
+        if task is None:
+            self.executed += 1
+            task = asyncio.ensure_future(coro_func(*args))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda finished: self.in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # shield: a client going away must not cancel the computation the other callers wait for
+        return await asyncio.shield(task)
+
+    def coalesce(self, coro_func):
+        # decorator, the key is the function and its (already normalized) positional arguments
+        @functools.wraps(coro_func)
+        async def wrapper(*args):
+            return await self.do((coro_func.__qualname__,) + args, coro_func, *args)
+
+        return wrapper
+
+    def get_metrics(self) -> dict:
+        return {
+            "calls": self.calls,
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": len(self.in_flight)
+        }
+
+
+query_flight = SingleFlight()
@@ -0,0 +1,86 @@
+import mimetypes
+import os
+import re
+import stat
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.staticfiles import StaticFiles
+
+# Output of scripts/build_static.py, used instead of the source files when it exists.
+build_dir = "build"
+
+# preferred first
+precompressed_variants = (("br", ".br"), ("gzip", ".gz"))
+
+fingerprint_pattern = re.compile(r"\.[0-9a-f]{10}\.[A-Za-z0-9]+$")
+immutable_cache_control = "public, max-age=31536000, immutable"
+revalidate_cache_control = "no-cache"
+
+
+def get_static_root():
+    if os.path.exists(os.path.join(build_dir, "manifest.json")):
+        return build_dir
+    return "."
+
+
+def get_accepted_encodings(accept_encoding: str):
+    accepted = set()
+    for item in accept_encoding.split(","):
+        encoding, _, params = item.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(encoding.strip().lower())
+    return accepted
+
+
+def get_cache_control(path: str):
+    if fingerprint_pattern.search(path):
+        return immutable_cache_control
+    return revalidate_cache_control
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    StaticFiles that sends the .br / .gz file written by scripts/build_static.py when the client accepts it,
+    and marks the fingerprinted files as immutable.
+    """
+
+    async def get_response(self, path: str, scope):
+        accepted = get_accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        response = None
+
+        for encoding, suffix in precompressed_variants:
+            if encoding not in accepted:
+                continue
+            full_path, stat_result = await run_in_threadpool(self.lookup_path, path + suffix)
+            if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+                response = self.file_response(full_path, stat_result, scope)
+                if response.status_code == 200:
+                    response.headers["content-type"] = \
+                        mimetypes.guess_type(path)[0] or "application/octet-stream"
+                    response.headers["content-encoding"] = encoding
+                break
+
+        if response is None:
+            response = await super().get_response(path, scope)
+
+        response.headers["vary"] = "Accept-Encoding"
+        if response.status_code in (200, 304):
+            response.headers["cache-control"] = get_cache_control(path)
+        return response
+
+
+class ApiGZipMiddleware(GZipMiddleware):
+    # only the JSON API is compressed on the fly, static files and pages come precompressed
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/api/"):
+            await super().__call__(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
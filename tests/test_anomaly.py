@@ -0,0 +1,61 @@
+from scripts.anomaly import AnomalyDetector, StreamingDetector
+
+
+def check_all(detector, values):
+    return [detector.check(value) for value in values]
+
+
+def test_hard_limits_do_not_update_the_state():
+    detector = StreamingDetector({"min": 850, "max": 1090})
+    assert check_all(detector, [1013.0, 0.0, 2000.0]) == [None, "below 850", "above 1090"]
+    assert detector.count == 1 and detector.last == 1013.0
+
+
+def test_z_score_needs_min_samples():
+    detector = StreamingDetector({"z_threshold": 4, "min_samples": 10, "min_std": 0.5})
+    assert check_all(detector, [10.0] * 5 + [100.0]) == [None] * 6
+
+    detector = StreamingDetector({"z_threshold": 4, "min_samples": 10, "min_std": 0.5})
+    check_all(detector, [10.0] * 20)
+    # the deviation of a constant series is 0, min_std is used instead: (13 - 10) / 0.5
+    assert detector.check(13.0) == "z-score 6.0"
+    assert detector.check(11.0) is None
+
+
+def test_z_score_follows_the_running_mean():
+    detector = StreamingDetector({"z_threshold": 4, "min_samples": 10, "min_std": 0.5, "alpha": 0.5})
+    check_all(detector, [10.0] * 20 + [10.5, 11.0, 11.5, 12.0, 12.5])
+    assert detector.mean > 11.5
+    assert detector.check(13.0) is None
+
+
+def test_jump_is_measured_from_the_last_accepted_value():
+    detector = StreamingDetector({"max_step": 5})
+    assert check_all(detector, [1013.0, 1030.0, 1013.5]) == [None, "jump of 17.00 from 1013.0", None]
+
+
+def test_persistent_change_is_accepted_after_max_consecutive():
+    detector = StreamingDetector({"max_step": 5, "max_consecutive": 3})
+    results = check_all(detector, [10.0] * 5 + [30.0] * 5)
+
+    assert results[5:8] == ["jump of 20.00 from 10.0"] * 3
+    assert results[8:] == [None, None]
+    # started over from the new level
+    assert detector.count == 2 and detector.mean == 30.0
+
+
+def test_seed_warms_up_the_detectors():
+    detector = AnomalyDetector({"baro": {"z_threshold": 4, "min_samples": 10}, "unknown": {"max": 1}})
+    assert list(detector.detectors) == ["baro"]
+
+    detector.seed([{"barometer": 1013.0, "windspd": 5.0}] * 20)
+    assert detector.check({"baro": 1020.0}) == [("baro", 1020.0, "z-score 14.0")]
+
+
+def test_seed_is_skipped_after_the_first_upload():
+    detector = AnomalyDetector({"baro": {"max_step": 5}})
+    detector.check({"baro": 1013.0})
+    detector.seed([{"barometer": 900.0}])
+
+    assert detector.detectors["baro"].count == 1
+    assert detector.check({"baro": 1014.0}) == []
@@ -0,0 +1,96 @@
+import os
+import uuid
+from datetime import datetime as dt, timedelta
+
+import pytest
+
+psycopg = pytest.importorskip("psycopg")
+
+from psycopg.conninfo import make_conninfo
+
+from scripts import anomaly
+from scripts.configs import GlobalConfig
+from scripts.queries import create_anomaly_tables_sql
+
+# The replay runs in the database, these tests need one: WEATHER_TEST_DATABASE=postgresql://... python -m pytest
+# Everything is created in a schema of its own and dropped afterwards.
+test_database = os.environ.get("WEATHER_TEST_DATABASE")
+pytestmark = pytest.mark.skipif(not test_database, reason="WEATHER_TEST_DATABASE is not set")
+
+create_weather_data_sql = """
+    CREATE TABLE weather_data
+    (
+        index_id      bigserial      not null primary key,
+        localdatetime timestamp(0)   not null,
+        barometer     numeric(10, 2) not null
+    );
+"""
+
+
+@pytest.fixture
+def database(monkeypatch):
+    schema = "replay_test_" + uuid.uuid4().hex[:8]
+    with psycopg.connect(test_database, autocommit=True) as conn:
+        conn.execute("CREATE SCHEMA " + schema)
+    conninfo = make_conninfo(test_database, options="-c search_path=" + schema)
+    monkeypatch.setattr(GlobalConfig, "loaded_cfg", {
+        "database": {"connection_str": conninfo},
+        "anomaly": {"enabled": True, "metrics": {"baro": {"min": 850, "max": 1090, "max_step": 5}}}
+    })
+    monkeypatch.setattr(GlobalConfig, "loaded_ok", True)
+
+    with psycopg.connect(conninfo, autocommit=True) as conn:
+        conn.execute(create_weather_data_sql)
+        conn.execute(create_anomaly_tables_sql)
+        yield conn
+    with psycopg.connect(test_database, autocommit=True) as conn:
+        conn.execute("DROP SCHEMA " + schema + " CASCADE")
+
+
+def insert_series(conn, values):
+    start = dt.now() - timedelta(hours=1)
+    return [conn.execute("INSERT INTO weather_data (localdatetime, barometer) VALUES (%s, %s) RETURNING index_id",
+                         (start + timedelta(minutes=i), value)).fetchone()[0]
+            for i, value in enumerate(values)]
+
+
+def get_flags(conn):
+    return dict(conn.execute("SELECT index_id, reason FROM weather_anomaly ORDER BY index_id").fetchall())
+
+
+def test_replay_twice_keeps_ingest_flags(database):
+    series = [1013.0] * 20
+    series[5] = 1030.0  # spike
+    series[10] = 0.0  # below the limit
+    series[15] = 1013.4  # flagged at ingest by a stricter rule, plausible for the replay
+    ids = insert_series(database, series)
+    ingest_flags = {
+        ids[5]: "jump of 17.00 from 1013.0",
+        ids[15]: "jump of 0.40 from 1013.0"
+    }
+    for index_id, reason in ingest_flags.items():
+        database.execute("INSERT INTO weather_anomaly VALUES (%s, now(), 'baro', 1, %s)", (index_id, reason))
+
+    assert anomaly.replay(1) == {"baro": 1}
+    first = get_flags(database)
+    assert first == {ids[5]: ingest_flags[ids[5]], ids[10]: "replay: below 850", ids[15]: ingest_flags[ids[15]]}
+
+    assert anomaly.replay(1) == {"baro": 1}
+    assert get_flags(database) == first
+
+
+def test_replay_removes_its_stale_flags(database):
+    ids = insert_series(database, [1013.0] * 10 + [800.0] + [1013.0] * 10)
+    anomaly.replay(1)
+    assert get_flags(database) == {ids[10]: "replay: below 850"}
+
+    GlobalConfig.loaded_cfg["anomaly"]["metrics"]["baro"] = {"min": 700}
+    assert anomaly.replay(1) == {"baro": 0}
+    assert get_flags(database) == {}
+
+
+def test_replay_flags_the_spike_but_not_the_sample_after_it(database):
+    ids = insert_series(database, [1013.0] * 10 + [1030.0] + [1013.0] * 10 + [1020.0] * 10)
+    anomaly.replay(1)
+
+    assert get_flags(database) == {ids[10]: "replay: jump from 1013"}
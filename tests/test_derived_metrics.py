@@ -0,0 +1,131 @@
+from datetime import datetime as dt, timedelta
+
+import pytest
+
+from scripts import derived_metrics
+from scripts.derived_metrics import DerivedMetricsState, WindowSum, feels_like
+
+start = dt(2026, 10, 19, 12, 0)
+
+
+def feed(state, samples, step=timedelta(minutes=5), time=start, **fixed):
+    """
+    Feeds one sample per step, samples are dicts overriding the defaults below. Returns the last metrics.
+    """
+    values = {"temp_out": 15.0, "heat_index": 15.0, "wind_chill": 15.0, "wind_speed": 0.0, "rain_rate": 0.0,
+              "barometer": 1013.0}
+    values.update(fixed)
+    metrics = None
+    for sample in samples:
+        metrics = state.update(time, **dict(values, **sample))
+        time += step
+    return metrics
+
+
+def test_window_sum_expires_old_items():
+    window = WindowSum(timedelta(hours=1))
+    window.add(start, 1.0)
+    window.add(start + timedelta(minutes=30), 2.0)
+    assert window.total == 3.0
+
+    window.add(start + timedelta(hours=1), 4.0)
+    assert window.total == 6.0
+
+    window.expire(start + timedelta(hours=3))
+    assert window.total == 0.0 and not window.items
+
+
+def test_rain_is_integrated_from_the_previous_rate():
+    state = DerivedMetricsState()
+    # 6 mm/h for 5 minutes is 0.5 mm per interval, 12 intervals in the hour
+    metrics = feed(state, [{"rain_rate": 6.0}] * 13)
+    assert metrics["rain_1h"] == pytest.approx(6.0)
+    assert metrics["rain_24h"] == pytest.approx(6.0)
+
+    metrics = feed(state, [{}] * 2, time=start + timedelta(minutes=65))
+    # the 12:00 - 12:05 interval left the hour, the last 6 mm/h interval (12:60 - 12:65) was added
+    assert metrics["rain_1h"] == pytest.approx(5.5)
+    assert metrics["rain_24h"] == pytest.approx(6.5)
+
+
+def test_no_integration_across_a_gap():
+    state = DerivedMetricsState()
+    feed(state, [{"rain_rate": 6.0, "wind_speed": 10.0}])
+    metrics = feed(state, [{}], time=start + timedelta(minutes=30))
+
+    assert metrics["rain_1h"] == 0.0
+    assert metrics["wind_run_today"] == 0.0
+
+
+def test_wind_run_restarts_at_midnight():
+    state = DerivedMetricsState()
+    # 10 m/s for 5 minutes is 3 km
+    metrics = feed(state, [{"wind_speed": 10.0}] * 3, time=dt(2026, 10, 19, 23, 45))
+    assert metrics["wind_run_today"] == pytest.approx(6.0)
+
+    # the 23:55 - 00:00 interval counts for the new day
+    metrics = feed(state, [{"wind_speed": 10.0}] * 2, time=dt(2026, 10, 20, 0, 0))
+    assert metrics["wind_run_today"] == pytest.approx(6.0)
+
+
+def test_pressure_tendency_needs_almost_three_hours():
+    state = DerivedMetricsState()
+    samples = [{"barometer": 1000.0 + i / 10} for i in range(20)]
+    step = timedelta(minutes=10)
+
+    assert feed(state, samples[:17], step)["pressure_tendency_3h"] is None  # 2:40 of data
+    assert feed(state, samples[17:18], step, start + 17 * step)["pressure_tendency_3h"] == pytest.approx(1.7)
+    assert feed(state, samples[18:19], step, start + 18 * step)["pressure_tendency_3h"] == pytest.approx(1.8)
+    # the 12:00 sample is older than 3 hours now, 12:10 is the oldest
+    assert feed(state, samples[19:20], step, start + 19 * step)["pressure_tendency_3h"] == pytest.approx(1.8)
+
+
+def test_feels_like_picks_heat_index_or_wind_chill():
+    assert feels_like(30.0, 33.0, 30.0, 5.0) == 33.0
+    assert feels_like(5.0, 5.0, 1.0, 5.0) == 1.0
+    assert feels_like(5.0, 5.0, 1.0, 1.0) == 5.0
+    assert feels_like(15.0, 16.0, 14.0, 5.0) == 15.0
+
+
+def test_seed_is_skipped_after_the_first_upload(monkeypatch):
+    monkeypatch.setattr(derived_metrics, "derived_state", DerivedMetricsState())
+    live = derived_metrics.update_derived({"dateobj": start, "temp_out": 15.0, "heatindex": 15.0, "chill_idx": 15.0,
+                                           "wind_spd": 2.0, "rainrate": 0.0, "baro": 1013.0})
+    seeded = derived_metrics.seed_derived_state([{
+        "Time": start - timedelta(minutes=5), "tempoutdoor": 30, "heatindex": 35, "WindChill": 30, "windspd": 0,
+        "rainrate": 0, "barometer": 1000, "flagged": []
+    }])
+
+    assert seeded == live
+    assert derived_metrics.derived_state.sample_count == 1
+
+
+def test_flagged_values_are_held():
+    state = DerivedMetricsState()
+    feed(state, [{"barometer": 1013.0}] * 36, timedelta(minutes=5))
+    time = start + 36 * timedelta(minutes=5)
+
+    metrics = state.update(time, 15.0, 15.0, 15.0, 0.0, 0.0, 0.0, flagged={"baro"})
+    assert metrics["pressure_tendency_3h"] == 0.0
+
+    state.update(time + timedelta(minutes=5), 15.0, 15.0, 15.0, 80.0, 500.0, 1013.0, flagged={"wind_spd", "rainrate"})
+    metrics = feed(state, [{}], time=time + timedelta(minutes=10))
+    assert metrics["rain_24h"] == 0.0
+    assert metrics["wind_run_today"] == 0.0
+
+
+def test_flagged_temperature_keeps_feels_like():
+    state = DerivedMetricsState()
+    feed(state, [{"temp_out": 5.0, "wind_chill": 2.0, "wind_speed": 4.0}])
+
+    metrics = state.update(start + timedelta(minutes=5), 60.0, 70.0, 60.0, 4.0, 0.0, 1013.0, flagged={"temp_out"})
+    assert metrics["feels_like"] == 2.0
+
+
+def test_seed_holds_the_stored_flags(monkeypatch):
+    monkeypatch.setattr(derived_metrics, "derived_state", DerivedMetricsState())
+    rows = [{"Time": start + timedelta(minutes=5 * i), "tempoutdoor": 15, "heatindex": 15, "WindChill": 15,
+             "windspd": 0, "rainrate": 0, "barometer": 1013, "flagged": []} for i in range(40)]
+    rows[-1].update(barometer=0, flagged=["baro"])
+
+    assert derived_metrics.seed_derived_state(rows)["pressure_tendency_3h"] == 0.0
@@ -0,0 +1,42 @@
+from datetime import datetime as dt
+
+import pytest
+
+from scripts import ingest
+
+
+@pytest.fixture
+def rules(monkeypatch):
+    def use_rules(config_rules):
+        monkeypatch.setattr(ingest, "compiled_rules", ingest.compile_sanity_rules(config_rules))
+
+    return use_rules
+
+
+def test_broken_rule_entries_are_skipped(rules, capsys):
+    rules({
+        "temp_in": None,
+        "temp_out": {"min": -50, "max": 60},
+        "hum_out": 5,
+        "baro": {"min": "low"},
+        "no_such_field": {"min": 0}
+    })
+
+    assert ingest.get_sanity_rules() == (("temp_out", -50, 60),)
+    output = capsys.readouterr().out
+    assert "hum_out" in output and "baro" in output and "no_such_field" in output
+
+
+def test_rules_that_are_not_a_mapping_fall_back_to_the_defaults(rules):
+    rules(["temp_in"])
+
+    assert ("temp_in", -100, None) in ingest.get_sanity_rules()
+
+
+def test_check_sanity_with_broken_entries(rules):
+    rules({"temp_in": None, "temp_out": {"max": 60}})
+    observation = {"dateobj": dt(2026, 10, 19), "temp_in": -500, "temp_out": 20}
+
+    assert ingest.check_sanity(observation) is None
+    observation["temp_out"] = 70
+    assert ingest.check_sanity(observation) == "temp_out=70 above 60"
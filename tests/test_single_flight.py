@@ -0,0 +1,64 @@
+import asyncio
+import time
+from datetime import datetime as dt, timedelta
+
+import main
+from scripts import db_ops
+
+
+class CountingFetch:
+    # stands in for db_ops.fetch_all, records the queries the "database" sees
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, query_name, params=None):
+        self.calls.append((query_name, params))
+        time.sleep(0.05)
+        return [{"Time": dt(2026, 10, 19, 12, 0), "TempOut": 10.5, "TempIn": 21.0}]
+
+
+def run_burst(monkeypatch, coro_funcs):
+    fetch = CountingFetch()
+    monkeypatch.setattr(db_ops, "fetch_all", fetch)
+    before = main.query_flight.get_metrics()
+
+    async def burst():
+        return await asyncio.gather(*[coro_func() for coro_func in coro_funcs])
+
+    results = asyncio.run(burst())
+    after = main.query_flight.get_metrics()
+    delta = {key: after[key] - before[key] for key in ("calls", "executed", "coalesced")}
+    return fetch, results, delta
+
+
+def test_burst_of_identical_requests_runs_one_query(monkeypatch):
+    burst_size = 50
+    interval = timedelta(hours=24)
+    fetch, results, delta = run_burst(monkeypatch,
+                                      [lambda: main.compute_temperature(interval)] * burst_size)
+
+    assert fetch.calls == [("temperature_since", {"interval": interval})]
+    assert delta == {"calls": burst_size, "executed": 1, "coalesced": burst_size - 1}
+    assert all(result == results[0] for result in results)
+    assert main.query_flight.get_metrics()["in_flight"] == 0
+
+
+def test_different_arguments_are_not_coalesced(monkeypatch):
+    fetch, results, delta = run_burst(monkeypatch, [
+        lambda: main.compute_temperature(timedelta(hours=1)),
+        lambda: main.compute_temperature(timedelta(hours=2)),
+        lambda: main.compute_temperature(None)
+    ])
+
+    assert len(fetch.calls) == 3
+    assert delta == {"calls": 3, "executed": 3, "coalesced": 0}
+
+
+def test_finished_results_are_not_cached(monkeypatch):
+    fetch = CountingFetch()
+    monkeypatch.setattr(db_ops, "fetch_all", fetch)
+
+    asyncio.run(main.compute_temperature(timedelta(hours=3)))
+    asyncio.run(main.compute_temperature(timedelta(hours=3)))
+
+    assert len(fetch.calls) == 2